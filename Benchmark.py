@@ -0,0 +1,509 @@
+#!/usr/bin/env python
+"""
+File: Benchmark.py
+Description: benchmarks for building the inverted index and for its
+             retrieval methods on synthetic or existing corpora
+"""
+import sys
+import os
+import time
+import random
+import bisect
+import shutil
+import tempfile
+import resource
+import platform
+import json
+import threading
+import multiprocessing
+import InvertedIndex
+import Shards
+
+from optparse import OptionParser
+
+class ZipfSampler:
+    """ class drawing ranks 0..n-1 with a probability proportional
+        to 1 / (rank+1)^exponent
+    """
+    def __init__(self, n, exponent, rand):
+        """ constructor method to compute the cumulative weights
+
+            Parameters:
+                n        -- number of ranks
+                exponent -- the zipf exponent, 1.0 for natural text
+                rand     -- random.Random object to draw with
+        """
+        self.rand = rand
+        self.cumulative = []
+        total = 0.0
+        for rank in range(n):
+            total += 1.0 / (rank + 1) ** exponent
+            self.cumulative.append(total)
+        self.total = total
+
+    def sample(self):
+        """ method to draw a rank """
+        return bisect.bisect(self.cumulative, self.rand.random() * self.total)
+
+def make_word(rank):
+    """ function to get the synthetic word for a rank, frequent words
+        are short and words share prefixes like in natural text
+    """
+    letters = "etaoinshrdlucmfwypvbgkjqxz"
+    word = ""
+    rank += 1
+    while rank > 0:
+        rank -= 1
+        word += letters[rank % len(letters)]
+        rank /= len(letters)
+    return word
+
+def generate_corpus(folder, documents, vocabulary, words, exponent, seed):
+    """ function to write a corpus of text files with zipf distributed
+        words. the same parameters always give the same corpus
+
+        Parameters:
+            folder     -- folder to write the files to
+            documents  -- number of files
+            vocabulary -- number of distinct words to draw from
+            words      -- average number of words per file
+            exponent   -- the zipf exponent
+            seed       -- seed of the random generator
+    """
+    rand = random.Random(seed)
+    sampler = ZipfSampler(vocabulary, exponent, rand)
+    vocab = [make_word(r) for r in range(vocabulary)]
+    for n in range(documents):
+        # spread the files over subfolders like real document trees
+        path = os.path.join(folder, "%03d" % (n / 1000))
+        if not os.path.isdir(path): os.makedirs(path)
+        f = open(os.path.join(path, "doc%07d.txt" % n), 'w')
+        try:
+            length = rand.randint(words / 2, words * 3 / 2)
+            line = []
+            for i in range(length):
+                line.append(vocab[sampler.sample()])
+                if (len(line) == 12):
+                    f.write(" ".join(line) + "\n")
+                    line = []
+            f.write(" ".join(line) + "\n")
+        finally:
+            f.close()
+
+def time_queries(method, queries, repeat):
+    """ function to measure the latency of a retrieval method
+
+        Parameters:
+            method  -- function called with the arguments of a query
+            queries -- list of argument lists
+            repeat  -- how often every query is run
+
+        Returns:
+            list of the latencies in milliseconds, sorted
+    """
+    latencies = []
+    for q in queries:
+        for i in range(repeat):
+            start = time.time()
+            method(*q)
+            latencies.append((time.time() - start) * 1000)
+    latencies.sort()
+    return latencies
+
+def percentile(latencies, p):
+    """ function to get a percentile of sorted latencies """
+    if not latencies: return 0.0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100.0))]
+
+def summarize(latencies):
+    """ function to get the statistics of sorted latencies
+
+        Returns:
+            dictionary with count, mean and percentiles in milliseconds
+    """
+    return {
+                "count" : len(latencies),
+                "mean"  : sum(latencies) / max(1, len(latencies)),
+                "p50"   : percentile(latencies, 50),
+                "p90"   : percentile(latencies, 90),
+                "p99"   : percentile(latencies, 99),
+                "max"   : percentile(latencies, 100)
+           }
+
+def get_max_rss():
+    """ function to get the peak resident set size in kilobytes """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def dict_intersection(postings, filenames, keywords):
+    """ the former intersection on hash maps, which filters the keys
+        of every list in the order the keywords were given. kept as
+        baseline for the intersection of the sorted posting lists
+
+        Parameters:
+            postings  -- hash map of the form { key : { docid : None } }
+            filenames -- list of the filenames indexed by docid
+            keywords  -- array of keywords to search for
+    """
+    comparelist = postings[keywords[0]]
+    for key in keywords[1:]:
+        comparelist = filter(comparelist.has_key, postings[key].keys())
+        comparelist = dict.fromkeys(comparelist)
+    returnlist = {}
+    for c in comparelist:
+        returnlist[filenames[c]] = c
+    return returnlist
+
+def benchmark_build(folder, workers, compress=False):
+    """ function to measure building the index of a folder
+
+        Parameters:
+            folder   -- folder with the documents
+            workers  -- number of processes to build with
+            compress -- whether to compress the posting lists
+
+        Returns:
+            the IndexManager and the build measurements
+    """
+    rss_before = get_max_rss()
+    manager = InvertedIndex.IndexManager(folder, compress=compress)
+    # silence the progress output of the build
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    try:
+        manager.build_index(workers)
+    finally:
+        sys.stdout = stdout
+    seconds = time.time() - start
+    # the completion trie is built on first use
+    start = time.time()
+    manager.get_completions("")
+    trie_seconds = time.time() - start
+    size,postings,per_posting = manager.get_memory_usage()
+    return manager, {
+                "seconds"           : seconds,
+                "trie_seconds"      : trie_seconds,
+                "compressed"        : compress,
+                "documents"         : manager.doc_count,
+                "terms"             : manager.get_index_size(),
+                "postings"          : postings,
+                "postings_bytes"    : size,
+                "bytes_per_posting" : per_posting,
+                "max_rss_kb"        : get_max_rss(),
+                "max_rss_before_kb" : rss_before
+           }
+
+def make_queries(manager, count, rand):
+    """ function to draw queries from the terms of an index, terms
+        are drawn with a zipf distribution over their frequency rank
+
+        Parameters:
+            manager -- IndexManager with a built index
+            count   -- number of queries per query class
+            rand    -- random.Random object to draw with
+
+        Returns:
+            hash map of the form { class : [ keywords, ... ] }
+    """
+    frequencies = manager.get_word_frequencies()
+    frequencies.reverse()
+    terms = [w for w,df in frequencies]
+    sampler = ZipfSampler(len(terms), 1.0, rand)
+    rare = [w for w,df in frequencies if df <= 3] or terms[-1:]
+    queries = {}
+    for length in (1, 2, 3):
+        queries["%s terms" % length] = [[terms[sampler.sample()] for i in range(length)]
+                                        for q in range(count)]
+    # the rare term is typed first, which is the worst order for
+    # the hash map intersection
+    queries["rare+common"] = [[rand.choice(rare), terms[sampler.sample()]]
+                              for q in range(count)]
+    return queries
+
+def benchmark_queries(manager, count, repeat, rand):
+    """ function to measure the latency of the retrieval methods
+
+        Parameters:
+            manager -- IndexManager with a built index
+            count   -- number of queries per query class
+            repeat  -- how often every query is run
+            rand    -- random.Random object to draw queries with
+
+        Returns:
+            hash map of the form { method : { class : statistics } }
+    """
+    queries = make_queries(manager, count, rand)
+    prefixes = {}
+    for length in (1, 2, 3):
+        prefixes["%s characters" % length] = [[w[:length]] for w in
+                                              [q[0] for q in queries["1 terms"]]]
+    postings = {}
+    for keywords in queries.itervalues():
+        for q in keywords:
+            for k in q:
+                postings[k] = dict.fromkeys(manager.get_documents(k).docids)
+    methods = {
+        "dict_intersection"     : (lambda q: dict_intersection(postings, manager.filenames, q),
+                                   queries, lambda q: [q]),
+        "get_intersected_list"  : (manager.get_intersected_list, queries, lambda q: [q]),
+        "get_andish_retrieval"  : (manager.get_andish_retrieval, queries, lambda q: [q, 10]),
+        "prefix_search"         : (manager.prefix_search, prefixes, lambda q: q),
+        "get_completions"       : (manager.get_completions, prefixes, lambda q: q + [10]),
+        "k_way_merge"           : (lambda p: manager.k_way_merge(manager.prefix_search(p)),
+                                   prefixes, lambda q: q)
+    }
+    results = {}
+    for name in sorted(methods):
+        method,classes,arguments = methods[name]
+        results[name] = {}
+        for c in sorted(classes):
+            latencies = time_queries(method, [arguments(q) for q in classes[c]], repeat)
+            results[name][c] = summarize(latencies)
+    return results
+
+def benchmark_batch(manager, count, repeat, rand, size=1000):
+    """ function to compare the throughput of answering queries in
+        batches with the one of answering them one after another
+
+        Parameters:
+            manager -- IndexManager with a built index
+            count   -- number of queries per query class
+            repeat  -- how often every query is run
+            rand    -- random.Random object to draw queries with
+            size    -- number of queries per batch
+
+        Returns:
+            dictionary with the throughput measurements
+    """
+    queries = make_queries(manager, count, rand)
+    queries = [q for c in sorted(queries) for q in queries[c]] * repeat
+    start = time.time()
+    for q in queries:
+        manager.get_andish_retrieval(q, 10)
+    sequential = time.time() - start
+    start = time.time()
+    for i in range(0, len(queries), size):
+        manager.get_batch_retrieval(queries[i:i+size], 10)
+    batch = time.time() - start
+    return {
+                "queries"        : len(queries),
+                "batch_size"     : size,
+                "sequential_qps" : len(queries) / sequential,
+                "batch_qps"      : len(queries) / batch
+           }
+
+def benchmark_impacts(manager, count, repeat, rand, limits=(1, 10, 50)):
+    """ function to compare ranked retrieval on the impact ordered
+        lists with the exhaustive one, in latency and in the number
+        of postings evaluated
+
+        Parameters:
+            manager -- IndexManager with a built, uncompressed index
+            count   -- number of queries per query class
+            repeat  -- how often every query is run
+            rand    -- random.Random object to draw queries with
+            limits  -- numbers of results to retrieve
+
+        Returns:
+            dictionary with the measurements
+    """
+    queries = make_queries(manager, count, rand)
+    queries = [q for c in sorted(queries) for q in queries[c]]
+    before = manager.get_memory_usage()[0]
+    start = time.time()
+    manager.impacts = []
+    manager.order_impacts()
+    seconds = time.time() - start
+    results = {
+                "order_seconds" : seconds,
+                "bytes"         : manager.get_memory_usage()[0] - before
+              }
+    impacts = manager.impacts
+    try:
+        for limit in limits:
+            arguments = [[q, limit] for q in queries]
+            measurements = {}
+            for name,lists in (("exhaustive", None), ("impacts", impacts)):
+                manager.impacts = lists
+                manager.evaluated = 0
+                latencies = time_queries(manager.get_andish_retrieval, arguments, repeat)
+                measurements[name] = summarize(latencies)
+                measurements[name]["evaluated"] = manager.evaluated / repeat
+            results["limit %s" % limit] = measurements
+    finally:
+        manager.impacts = None
+        manager.evaluated = 0
+    return results
+
+def benchmark_throughput(index, queries, threads):
+    """ function to measure how many queries are answered per second
+        when several threads send them at the same time
+
+        Parameters:
+            index   -- IndexManager or Shards.ShardedIndex to query
+            queries -- list of keyword lists
+            threads -- number of threads sending the queries
+
+        Returns:
+            number of queries answered per second
+    """
+    def run(part):
+        for q in part:
+            index.get_andish_retrieval(q, 10)
+    workers = [threading.Thread(target=run, args=(queries[i::threads],))
+               for i in range(threads)]
+    start = time.time()
+    for w in workers: w.start()
+    for w in workers: w.join()
+    return len(queries) / (time.time() - start)
+
+def benchmark_shards(folder, manager, shards, threads, count, repeat, rand):
+    """ function to compare the query throughput of a single index
+        with the one of an index spread over several processes
+
+        Parameters:
+            folder  -- folder with the documents
+            manager -- IndexManager with the index of the folder
+            shards  -- number of shards
+            threads -- number of threads sending queries
+            count   -- number of queries per query class
+            repeat  -- how often every query is run
+            rand    -- random.Random object to draw queries with
+
+        Returns:
+            dictionary with the throughput measurements
+    """
+    queries = make_queries(manager, count, rand)
+    queries = [q for c in sorted(queries) for q in queries[c]] * repeat
+    sharded = Shards.ShardedIndex(folder, shards, manager.compress)
+    start = time.time()
+    sharded.build_index()
+    seconds = time.time() - start
+    try:
+        return {
+                    "shards"              : shards,
+                    "threads"             : threads,
+                    "cpus"                : multiprocessing.cpu_count(),
+                    "build_seconds"       : seconds,
+                    "single_qps"          : benchmark_throughput(manager, queries, threads),
+                    "sharded_qps"         : benchmark_throughput(sharded, queries, threads)
+               }
+    finally:
+        sharded.close()
+
+def print_results(results):
+    """ function to print the results in a table """
+    build = results["build"]
+    print "Built %sindex of %s documents, %s terms and %s postings in %.3fs." % (
+          build["compressed"] and "compressed " or "", build["documents"],
+          build["terms"], build["postings"], build["seconds"])
+    print "Postings use %.1f bytes each, peak RSS %s kB." % (
+          build["bytes_per_posting"], build["max_rss_kb"])
+    print "%-22s %-14s %10s %10s %10s %10s" % ("method", "queries", "mean",
+                                               "p50", "p90", "p99")
+    for name in sorted(results["queries"]):
+        for c in sorted(results["queries"][name]):
+            s = results["queries"][name][c]
+            print "%-22s %-14s %8.3fms %8.3fms %8.3fms %8.3fms" % (name, c,
+                  s["mean"], s["p50"], s["p90"], s["p99"])
+    b = results["batch"]
+    print "and-ish retrieval of %s queries: %.1f queries/s one by one," % (
+          b["queries"], b["sequential_qps"]),
+    print "%.1f queries/s in batches of %s." % (b["batch_qps"], b["batch_size"])
+    if "impacts" in results:
+        i = results["impacts"]
+        print "Impact ordered lists use %s bytes, ordered in %.3fs." % (
+              i["bytes"], i["order_seconds"])
+        for name in sorted(n for n in i if n.startswith("limit")):
+            e,r = i[name]["exhaustive"],i[name]["impacts"]
+            print "and-ish retrieval with %-9s %s of %s postings evaluated (%.1f%%)," % (
+                  name + ":", r["evaluated"], e["evaluated"],
+                  100.0 * r["evaluated"] / max(1, e["evaluated"])),
+            print "mean %.3fms instead of %.3fms." % (r["mean"], e["mean"])
+    if "throughput" in results:
+        t = results["throughput"]
+        print "and-ish retrieval with %s threads on %s cpus: %.1f queries/s," % (
+              t["threads"], t["cpus"], t["single_qps"]),
+        print "%.1f queries/s with %s shards." % (t["sharded_qps"], t["shards"])
+
+def main():
+    """ main function to run the benchmarks
+    """
+    usage = "usage: %prog [options]"
+    parser = OptionParser(usage)
+    parser.add_option("-f", "--folder", action="store", dest="folder", metavar="FOLDER",
+                      help="index this folder instead of generating a corpus")
+    parser.add_option("-n", "--documents", action="store", type="int", dest="documents",
+                      metavar="NUM", default="2000", help="number of generated documents")
+    parser.add_option("-v", "--vocabulary", action="store", type="int", dest="vocabulary",
+                      metavar="NUM", default="20000", help="number of distinct generated words")
+    parser.add_option("-l", "--length", action="store", type="int", dest="length",
+                      metavar="NUM", default="300", help="average number of words per document")
+    parser.add_option("-z", "--zipf", action="store", type="float", dest="zipf",
+                      metavar="S", default="1.0", help="zipf exponent of the word distribution")
+    parser.add_option("-s", "--seed", action="store", type="int", dest="seed",
+                      metavar="NUM", default="42", help="seed for the corpus and the queries")
+    parser.add_option("-w", "--workers", action="store", type="int", dest="workers",
+                      metavar="NUM", default="1", help="number of processes to build with")
+    parser.add_option("-c", "--compress", action="store_true", dest="compress", default=False,
+                      help="compress the posting lists")
+    parser.add_option("-i", "--impacts", action="store_true", dest="impacts", default=False,
+                      help="compare ranked retrieval on impact ordered lists with the exhaustive one")
+    parser.add_option("-p", "--shards", action="store", type="int", dest="shards",
+                      metavar="NUM", default="0", help="compare the throughput with this many shards")
+    parser.add_option("-t", "--threads", action="store", type="int", dest="threads",
+                      metavar="NUM", default="4", help="number of threads sending queries to the shards")
+    parser.add_option("-q", "--queries", action="store", type="int", dest="queries",
+                      metavar="NUM", default="100", help="number of queries per query class")
+    parser.add_option("-r", "--repeat", action="store", type="int", dest="repeat",
+                      metavar="NUM", default="3", help="how often every query is run")
+    parser.add_option("-o", "--output", action="store", dest="output", metavar="FILE",
+                      help="write the results as json to this file")
+    parser.add_option("-k", "--keep", action="store_true", dest="keep", default=False,
+                      help="keep the generated corpus")
+    (options, args) = parser.parse_args()
+    if (options.impacts and options.compress):
+        parser.error("Impact ordered lists need uncompressed posting lists.")
+
+    results = {
+                "time"     : time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python"   : platform.python_version(),
+                "numpy"    : InvertedIndex.numpy and InvertedIndex.numpy.__version__,
+                "platform" : platform.platform(),
+                "options"  : dict(vars(options))
+              }
+    folder = options.folder
+    if not folder:
+        folder = tempfile.mkdtemp(prefix="admiral-corpus-")
+        print "Generating corpus in %s..." % (folder)
+        generate_corpus(folder, options.documents, options.vocabulary,
+                        options.length, options.zipf, options.seed)
+    try:
+        manager,results["build"] = benchmark_build(folder, options.workers,
+                                                   options.compress)
+        rand = random.Random(options.seed)
+        results["queries"] = benchmark_queries(manager, options.queries,
+                                               options.repeat, rand)
+        results["batch"] = benchmark_batch(manager, options.queries,
+                                           options.repeat, rand)
+        if options.impacts:
+            results["impacts"] = benchmark_impacts(manager, options.queries,
+                                                   options.repeat, rand)
+        if (options.shards > 1):
+            results["throughput"] = benchmark_shards(folder, manager, options.shards,
+                                                     options.threads, options.queries,
+                                                     options.repeat, rand)
+    finally:
+        if not options.folder and not options.keep:
+            shutil.rmtree(folder)
+    print_results(results)
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+        print "Results written to %s." % (options.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+File: Cache.py
+Description: bounded LRU cache for the responses of the webserver
+"""
+import threading
+from collections import OrderedDict
+
+class ResultCache:
+    """ class implementing a least recently used cache, bounded by
+        the number of entries and the total size of the values.
+
+        all entries belong to a generation, e.g. the state of the
+        index they were computed from. when a different generation
+        is asked for, the whole cache is dropped.
+    """
+    def __init__(self, max_entries=1024, max_bytes=16*1024*1024):
+        """ constructor method to set the cache limits
+
+            Parameters:
+                max_entries -- maximum number of cached values
+                max_bytes   -- maximum total length of the cached values
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, generation):
+        """ method to look up a value, marking it as recently used
+
+            Parameters:
+                key        -- the key of the value
+                generation -- the generation the value has to belong to
+
+            Returns:
+                the cached value or None
+        """
+        with self.lock:
+            if (generation != self.generation):
+                self.clear(generation)
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation):
+        """ method to store a value, evicting the least recently
+            used values if the cache gets too big
+
+            Parameters:
+                key        -- the key of the value
+                value      -- the value, a string
+                generation -- the generation the value belongs to
+        """
+        if (len(value) > self.max_bytes or self.max_entries <= 0): return
+        with self.lock:
+            if (generation != self.generation):
+                self.clear(generation)
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = value
+            self.size += len(value)
+            while (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                self.size -= len(self.entries.popitem(last=False)[1])
+                self.evictions += 1
+
+    def clear(self, generation=None):
+        """ method to drop all entries, has to be called with the
+            lock held
+
+            Parameters:
+                generation -- the new generation of the cache
+        """
+        self.entries.clear()
+        self.size = 0
+        self.generation = generation
+
+    def get_stats(self):
+        """ method to get the counters of the cache
+
+            Returns:
+                dictionary with the cache counters
+        """
+        with self.lock:
+            return {
+                        "hits"      : self.hits,
+                        "misses"    : self.misses,
+                        "evictions" : self.evictions,
+                        "entries"   : len(self.entries),
+                        "bytes"     : self.size
+                   }
@@ -0,0 +1,83 @@
+"""
+@file Codec.py
+@brief variable byte encoding of integer sequences
+@version 0.1
+
+every number is stored in 7 bit groups, lowest group first. the
+high bit of a byte is set if more groups of the same number follow.
+sorted sequences are stored as gaps between successive numbers, so
+most numbers fit in a single byte.
+"""
+
+def append_varbyte(out, value):
+    """ function to append a non negative number to a buffer
+
+        Parameters:
+            out   -- bytearray to append to
+            value -- the number to encode
+    """
+    while value >= 128:
+        out.append((value & 127) | 128)
+        value >>= 7
+    out.append(value)
+
+def decode_varbytes(data, start, count):
+    """ function to decode a number of values from a buffer
+
+        Parameters:
+            data  -- bytearray holding the encoded values
+            start -- offset of the first value
+            count -- number of values to decode
+
+        Returns:
+            list of the values and the offset behind the last one
+    """
+    values = []
+    position = start
+    for i in xrange(count):
+        value = 0
+        shift = 0
+        byte = data[position]
+        while byte >= 128:
+            value |= (byte & 127) << shift
+            shift += 7
+            position += 1
+            byte = data[position]
+        values.append(value | (byte << shift))
+        position += 1
+    return values,position
+
+def decode_gaps(data, start, count, base=0):
+    """ function to decode a sorted sequence stored as gaps
+
+        Parameters:
+            data  -- bytearray holding the encoded gaps
+            start -- offset of the first gap
+            count -- number of values to decode
+            base  -- value the first gap is relative to
+
+        Returns:
+            list of the values and the offset behind the last one
+    """
+    values,position = decode_varbytes(data, start, count)
+    for i in xrange(count):
+        base += values[i]
+        values[i] = base
+    return values,position
+
+def skip_varbytes(data, start, count):
+    """ function to skip a number of values without decoding them
+
+        Parameters:
+            data  -- bytearray holding the encoded values
+            start -- offset of the first value
+            count -- number of values to skip
+
+        Returns:
+            offset behind the last skipped value
+    """
+    position = start
+    while (count > 0):
+        if (data[position] < 128): count -= 1
+        position += 1
+    return position
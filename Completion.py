@@ -0,0 +1,112 @@
+"""
+@file Completion.py
+@brief prefix completion with precomputed top completions
+@version 0.1
+"""
+
+import bisect
+import heapq
+
+class CompletionTrie:
+    """ Class for completing prefixes to the most frequent terms
+
+        the trie is laid over the sorted term list of the index, so
+        every node is just the range of terms sharing its prefix. only
+        nodes with more than threshold terms are stored, together with
+        their best completions in the form of
+
+        nodes = {
+                    prefix : [ (-df, term), ... ]
+                }
+        where df is the document frequency of the term. prefixes of
+        fewer terms are completed by ranking their range directly,
+        so no lookup has to look at more than threshold terms.
+    """
+    def __init__(self, terms, dfs, size=10, threshold=64):
+        """ Constructor which builds the trie
+
+            Parameters:
+                terms     -- sorted sequence of the terms
+                dfs       -- sequence of the document frequencies,
+                             in the order of the terms
+                size      -- number of completions stored per node
+                threshold -- maximum number of terms of a prefix
+                             which is not stored as a node
+        """
+        self.terms = terms
+        self.dfs = dfs
+        self.size = size
+        self.threshold = max(threshold, size)
+        self.nodes = {}
+        if len(terms):
+            self.build_node(0, len(terms), 0)
+
+    def build_node(self, lo, hi, depth):
+        """ method to build the node for the terms in [lo, hi) which
+            share their first depth characters, and all nodes below
+
+            Returns:
+                the best completions of the node
+        """
+        if (hi - lo <= self.threshold):
+            return self.rank(lo, hi, self.size)
+        prefix = self.terms[lo][:depth]
+        candidates = []
+        i = lo
+        # the term equal to the prefix is sorted first
+        if (len(self.terms[i]) == depth):
+            candidates.append((-self.dfs[i], self.terms[i]))
+            i += 1
+        # split the rest of the range by the next character
+        while (i < hi):
+            c = self.terms[i][depth]
+            if (ord(c) == 255):
+                end = hi
+            else:
+                end = bisect.bisect_left(self.terms, prefix + chr(ord(c) + 1), i, hi)
+            candidates.extend(self.build_node(i, end, depth + 1))
+            i = end
+        top = heapq.nsmallest(self.size, candidates)
+        self.nodes[prefix] = top
+        return top
+
+    def rank(self, lo, hi, limit):
+        """ method to get the most frequent terms of a range
+
+            Returns:
+                list of (-df, term) tuples, most frequent first
+        """
+        return heapq.nsmallest(limit, [(-self.dfs[i], self.terms[i])
+                                       for i in xrange(lo, hi)])
+
+    def get_range(self, prefix):
+        """ method to get the range of terms starting with a prefix
+
+            Returns:
+                tuple of the first and behind the last position
+        """
+        lo = bisect.bisect_left(self.terms, prefix)
+        if not prefix: return lo,len(self.terms)
+        last = prefix[-1]
+        if (ord(last) == 255): return lo,len(self.terms)
+        hi = bisect.bisect_left(self.terms, prefix[:-1] + chr(ord(last) + 1), lo)
+        return lo,hi
+
+    def complete(self, prefix, limit=None):
+        """ method to get the most frequent completions of a prefix
+
+            Parameters:
+                prefix -- the prefix to complete
+                limit  -- maximum number of completions, at most and
+                          by default the number stored per node
+
+            Returns:
+                list of (term, df) tuples, most frequent first
+        """
+        if limit is None: limit = self.size
+        limit = min(limit, self.size)
+        top = self.nodes.get(prefix)
+        if top is None:
+            lo,hi = self.get_range(prefix)
+            top = self.rank(lo, hi, limit)
+        return [(term,-df) for df,term in top[:limit]]
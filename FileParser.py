@@ -12,47 +12,137 @@ import os
 import hashlib
 import re
 import pickle
+import zlib
 
 class DocumentParser:
     """ Document parsing class
     """
-    def __init__(self,folder):
+    def __init__(self,folder,walk=True,shard=None):
         """ Constructor
 
             Parameters:
                 folder - path to the folder in which the documents to index reside
+                walk   - whether to look up the documents in the folder
+                shard  - tuple of (number, count) to only look up the
+                         documents of one of count shards
         """
+        self.shard = shard
         self.doccounter = 0
         self.documents = []
+        self.chunksize = 65536
+        self.re_word = re.compile("\w+")
         if (re.findall("/$",folder)): self.folder = folder
         else: self.folder = folder +"/"
+        if not walk: return
+        self.documents = self.scan()
+
+    def scan(self):
+        """ method to look up the documents in the folder and
+            all of its subfolders
+
+            Returns:
+                sorted list of the document paths relative to the folder
+        """
+        documents = []
+        for root, folders, files in os.walk(self.folder):
+            path = root[len(self.folder):]
+            for f in files:
+                documents.append(os.path.join(path, f))
+        if self.shard is not None:
+            # the checksum of the name keeps a file in the same shard
+            number,count = self.shard
+            documents = [d for d in documents
+                         if (zlib.crc32(d) & 0xffffffff) % count == number]
+        documents.sort()
+        return documents
+
+    def get_file_state(self,doc):
+        """ method to get the modification time and size of a file
+
+            Parameters:
+                doc -- the filename of the document
+
+            Returns:
+                tuple of (mtime, size) or None if the file is gone
+        """
         try:
-            for root, folders, files in os.walk(self.folder):
-                self.documents = files
-        except:
-            pass
+            stat = os.stat(self.folder+doc)
+        except OSError:
+            return None
+        return stat.st_mtime,stat.st_size
+
+    def get_file_hash(self,doc):
+        """ method to get the md5 digest of a file's content
+
+            Parameters:
+                doc -- the filename of the document
+
+            Returns:
+                the binary md5 digest
+        """
+        digest = hashlib.md5()
+        try:
+            f = open(self.folder+doc, 'rb')
+        except IOError:
+            return digest.digest()
+        try:
+            while True:
+                chunk = f.read(self.chunksize)
+                if not chunk: break
+                digest.update(chunk)
+        finally:
+            f.close()
+        return digest.digest()
 
-    def parse_file(self,doc):
+    def parse_file(self,doc,digest=None):
         """ Method to call for parsing a file
 
             Parameters:
-                doc -- the filename of the document to parse
+                doc    -- the filename of the document to parse
+                digest -- optional hashlib object to feed the content to
 
             Returns:
                 hash of the textfile as ID
-                array of words contained in the textfile
+                iterator over (position, word) tuples of the lowercased
+                words contained in the textfile
+        """
+        self.doccounter = self.doccounter+1
+        return self.doccounter,enumerate(self.tokenize(doc,digest))
+
+    def tokenize(self,doc,digest=None):
+        """ generator to stream the words of a file. the file is read
+            in chunks, so it never has to be held in memory completely
+
+            Parameters:
+                doc    -- the filename of the document to tokenize
+                digest -- optional hashlib object to feed the content to
+
+            Returns:
+                the lowercased words of the file, one at a time
         """
-        words = []
         try:
-            f = open(self.folder+doc, 'r')
-            for line in f.readlines():
-                matches = re.findall('\w+', line)
-                words.extend(matches)
+            f = open(self.folder+doc, 'rb')
+        except IOError:
+            return
+        try:
+            rest = ""
+            while True:
+                chunk = f.read(self.chunksize)
+                if not chunk: break
+                if digest is not None: digest.update(chunk)
+                chunk = rest + chunk.lower()
+                rest = ""
+                last = None
+                for match in self.re_word.finditer(chunk):
+                    if last is not None: yield last.group()
+                    last = match
+                if last is None: continue
+                # the last word might continue in the next chunk
+                if last.end() == len(chunk): rest = last.group()
+                else: yield last.group()
+            if rest: yield rest
+        finally:
             f.close()
-        except:
-            pass
-        self.doccounter = self.doccounter+1
-        return self.doccounter,words
 
     def get_documents(self):
         """ method to return documents"""
@@ -6,98 +6,694 @@
 @date 2009-10-24
 """
 
+import os
 import heapq
+import shutil
+import hashlib
+import tempfile
 import sys
+import threading
+import functools
+import multiprocessing
 import FileParser
+import Postings
+import Segment
+import Completion
+import Terms
 import bisect
+from array import array
+import itertools
 from math import log
 from operator import itemgetter
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# source of unique numbers for the states of all indexes
+generations = itertools.count(1)
+
+# estimated bytes used per term, per word and per document while an
+# index is built within a memory budget
+TERM_BYTES = 700
+WORD_BYTES = 12
+DOCUMENT_BYTES = 500
+# number of run files read at the same time while they are merged
+MERGE_FANIN = 64
+
+# relative cost of reading a posting from the impact ordered lists,
+# compared to adding up a posting in an exhaustive search, with a hash
+# map and with numpy
+IMPACT_COST = 4
+IMPACT_VECTOR_COST = 256
+
+# scores are accumulated with numpy for queries with at least this many
+# postings plus one per VECTOR_DENSITY documents in the index, since
+# every vectorized search clears an array over all documents
+VECTOR_MIN = 128
+VECTOR_DENSITY = 64
+
+# completions stored per prefix, the most a prefix search returns
+MAX_COMPLETIONS = 100
+
+def get_peak_memory():
+    """ function to get the largest amount of memory the process has
+        used so far
+
+        Returns:
+            size in bytes, 0 if the platform doesn't tell
+    """
+    if resource is None: return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux counts kilobytes, mac os x bytes
+    if (sys.platform != "darwin"): peak *= 1024
+    return peak
+
+def build_partial_index(task):
+    """ function to build the index for a part of the documents,
+        used by the worker processes of a parallel build
+
+        Parameters:
+            task -- tuple of the folder and a list of
+                    (docid, filename) tuples to index
+
+        Returns:
+            hash map of the form { key : postings }
+            hash map of the form { filename : manifest entry }
+    """
+    folder, documents = task
+    parser = FileParser.DocumentParser(folder, walk=False)
+    index = {}
+    manifest = {}
+    for docid,d in documents:
+        state = parser.get_file_state(d) or (0, 0)
+        digest = hashlib.md5()
+        add_words(index, docid, enumerate(parser.tokenize(d, digest)))
+        manifest[d] = (docid,) + state + (digest.digest(),)
+    return index,manifest
+
+def add_words(index, doc, words):
+    """ function to add the words of a document to an index
+
+        Parameters:
+            index -- hash map of the form { key : postings }
+            doc   -- the document id the words belong to
+            words -- iterable of (position, word) tuples of
+                     lowercased words
+
+        Returns:
+            number of words added
+    """
+    position = -1
+    for position,w in words:
+        try:
+            postings = index[w]
+        except KeyError:
+            postings = index[w] = Postings.PostingList()
+        postings.add(doc, position)
+    return position + 1
+
+class IndexLock(object):
+    """ Class letting many searches read an index at the same time,
+        while a new state of the index is only published when none of
+        them is running. a thread already reading may read again, so
+        reading methods can call each other. new searches wait while
+        an update waits, so a steady stream of searches can not hold
+        off updates
+    """
+    def __init__(self):
+        """ Constructor
+        """
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writers = 0
+        self.writing = False
+        self.local = threading.local()
+
+    def acquire_read(self):
+        """ method to start reading the index """
+        depth = getattr(self.local, "depth", 0)
+        if (depth == 0):
+            with self.condition:
+                while (self.writing or self.writers > 0):
+                    self.condition.wait()
+                self.readers += 1
+        self.local.depth = depth + 1
+
+    def release_read(self):
+        """ method to stop reading the index """
+        self.local.depth -= 1
+        if (self.local.depth == 0):
+            with self.condition:
+                self.readers -= 1
+                if (self.readers == 0): self.condition.notify_all()
+
+    def acquire_write(self):
+        """ method to wait until the index can be changed """
+        with self.condition:
+            self.writers += 1
+            while (self.writing or self.readers > 0):
+                self.condition.wait()
+            self.writers -= 1
+            self.writing = True
+
+    def release_write(self):
+        """ method to let searches read the index again """
+        with self.condition:
+            self.writing = False
+            self.condition.notify_all()
+
+def reading(method):
+    """ decorator for the methods of the IndexManager reading the index,
+        they never see an update half published
+    """
+    @functools.wraps(method)
+    def read(self, *args, **kwargs):
+        self.lock.acquire_read()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.lock.release_read()
+    return read
 
 class IndexManager:
     """ Class for managing the complete index
 
-        this class manages an inverted index in a simple
+        while documents are added the postings are collected in a
         hash map of the form
 
         index = {
-                    key : documents
+                    key : postings
                 }
-        where key is the word and documents is also a hash
-        map containing the document id and term frequency
-        in the form of
+        where key is the word and postings is a compact
+        Postings.PostingList holding parallel arrays of the
+        sorted document ids, term frequencies and scores
+
+        when the index is finalized the words are moved into a
+        Terms.TermDictionary, which assigns the term ids, and the
+        posting lists into a list indexed by the term id
+
+        terms    = TermDictionary([ key, ... ])
+        postings = [ postings, ... ]
+
+        the names of the documents are kept in a list indexed by
+        the document id, removed documents leave None behind
+
+        filenames = [ None, filename, ... ]
+
+        postings.docids = [ doc, ... ]
+        postings.tfs    = [ tf, ... ]
+        postings.scores = [ tf.idf, ... ]
 
-        document = {
-                        doc  : scores
+        with compression the finalized lists are replaced by
+        Postings.CompressedPostingList objects, which use less memory
+        but have to be decoded block by block when they are searched
+
+        with impacts every list also gets a Postings.ImpactList, holding
+        its postings ordered by score. ranked searches for the best
+        results read these from the top and stop as soon as no other
+        document can make it into the results
+
+        impacts = [ impacts, ... ]
+
+        if numpy is installed, the scores of searches over many postings
+        are added up in an array indexed by document id instead of a
+        hash map
+
+        to update the index incrementally a manifest of all
+        indexed files is kept in the form of
+
+        manifest = {
+                       filename : (docid, mtime, size, md5 digest)
                    }
-        scores = {
-                    'tf' : value,
-                    'tf.idf' ; value
-                 }
     """
-    def __init__(self,folder):
+    def __init__(self,folder,walk=True,compress=False,shard=None,impacts=False):
         """ Constructor which creates the index and the set to hold
             the actual filenames
+
+            Parameters:
+                folder   -- the folder with the documents to index
+                walk     -- whether to look up the documents in the folder,
+                            not needed when the index is loaded from disk
+                compress -- whether to compress the finalized posting lists
+                shard    -- tuple of (number, count) to only index the
+                            documents of one of count shards
+                impacts  -- whether to keep the postings ordered by score
+                            as well, to stop ranked searches early
         """
         self.index = {}
-        self.filenames = {}
-        self.parser = FileParser.DocumentParser(folder)
+        self.filenames = [None]
+        self.manifest = {}
+        self.parser = FileParser.DocumentParser(folder,walk,shard)
         self.doc_count = self.parser.get_documents_count()
-        self.index_keys = []
+        self.terms = Terms.build_dictionary([])
+        self.postings = []
+        self.completions = None
+        self.compress = compress
+        # the impact ordered lists, None if they are not kept
+        self.impacts = None
+        if impacts: self.impacts = []
+        # number of postings looked at by ranked searches
+        self.evaluated = 0
+        # whether to add up scores with numpy
+        self.vectorize = numpy is not None
+        # fraction of the documents indexed by build_index
+        self.progress = 0.0
+        # number of words in the hash map
+        self.buffered_words = 0
+        # changes whenever the index is finalized or loaded
+        self.generation = generations.next()
+        # searches read the index while updates are published with it
+        self.lock = IndexLock()
+        # only one update is built at a time
+        self.updating = threading.Lock()
 
-    def build_index(self):
+    def build_index(self, workers=1):
         """ method to build the inverted index for the
             documents in the given folder. the file parser
             object is used to parse the single files.
+
+            Parameters:
+                workers -- number of processes to build the index with
         """
+        if (workers > 1):
+            return self.build_index_parallel(workers)
         docs = self.parser.get_documents()
-        percentfactor = float(100/float(len(docs)))
+        percent = 0
         count = 0
         for d in docs:
             count += 1
-            docid,words = self.parser.parse_file(d)
-            for w in words:
-                self.add_key(w,docid,d)
-            percentagestring = "%.3f%% done." % (count * percentfactor)
-            print percentagestring
+            self.add_document(d)
+            self.progress = float(count) / len(docs)
+            # only whole percents are printed, printing a line per
+            # document slows down the build
+            if (int(self.progress * 100) > percent):
+                percent = int(self.progress * 100)
+                print "%d%% done." % (percent)
         print "\n"
-        self.index_keys = self.index.keys()
-        self.index_keys.sort()
+        self.finalize()
 
-    def add_key(self, key, doc, filename):
-        """ method to add a document to a index object
-            or create a new object
+    def build_index_parallel(self, workers):
+        """ method to build the inverted index with a pool of worker
+            processes. the documents are split into consecutive chunks,
+            every worker builds a partial index for its chunk and the
+            partial indexes are merged in document id order.
 
             Parameters:
-                key         -- the keyword to add to the index
-                doc         -- the document id to add
-                filename    -- the actual name of the document
+                workers -- number of worker processes
         """
-        key = key.lower()
-        self.filenames[doc] = filename
-        # see if we already have the word in the index
-        docobj = None
+        docs = self.parser.get_documents()
+        # assign the document ids up front, so that the chunks cover
+        # consecutive id ranges and can be merged by appending
+        documents = list(enumerate(docs, 1))
+        self.filenames = [None] + list(docs)
+        chunksize = max(1, len(documents) / (workers * 4))
+        tasks = [(self.parser.folder, documents[i:i+chunksize])
+                 for i in range(0, len(documents), chunksize)]
+        pool = multiprocessing.Pool(workers)
         try:
-            # get hash map entry for corresponding word
-            docobj = self.index[key]
-            try:
-                # docobj should have tf and tf.idf entry
-                docobj[doc]['tf'] += 1
-                #tf.idf = tf * log (N / df)
-                docobj[doc]['tf.idf'] = (float(docobj[doc]['tf'])
-                                        * log(self.doc_count/len(self.index[key]),10))
-            except KeyError:
-                # enter a new document
-                docobj[doc] = { 'tf' : 1, 'tf.idf' : 0}
-                #tf.idf = tf * log (N / df)
-                docobj[doc]['tf.idf'] = (float(docobj[doc]['tf'])
-                                                  * log(self.doc_count/len(docobj),10))
+            count = 0
+            for partial,manifest in pool.imap(build_partial_index, tasks):
+                for key,postings in partial.iteritems():
+                    try:
+                        self.index[key].extend(postings)
+                    except KeyError:
+                        self.index[key] = postings
+                self.manifest.update(manifest)
+                count += 1
+                self.progress = float(count) / len(tasks)
+                print "%.3f%% done." % (self.progress * 100)
+        finally:
+            pool.close()
+            pool.join()
+        print "\n"
+        self.parser.doccounter = len(documents)
+        self.finalize()
 
-        except KeyError:
-            self.index[key] = { doc : { 'tf' : 1, 'tf.idf' : 0} }
+    def build_index_external(self, budget, filepath=None):
+        """ method to build the inverted index within a memory budget,
+            in a single pass over the documents. the postings are
+            collected in the hash map until their estimated size
+            reaches the budget, then they are written to a run file
+            sorted by term and the hash map is emptied. at the end the
+            runs are merged term by term into a segment file, which
+            is served through mmap. the table of the documents is kept
+            in memory, like it is when a segment is loaded
+
+            Parameters:
+                budget   -- bytes of memory the process may use
+                filepath -- the segment file to write, a temporary file
+                            is used and deleted once it is mapped if
+                            this is None
+        """
+        # the memory already in use is not available for postings
+        used = get_peak_memory()
+        if (budget <= used):
+            raise ValueError("memory budget of %d bytes is below the %d bytes in use"
+                             % (budget, used))
+        docs = self.parser.get_documents()
+        # a quarter is kept for the memory left fragmented by the
+        # spilled runs and for loading the segment, the table of the
+        # documents stays in memory during the whole build
+        table = DOCUMENT_BYTES * len(docs)
+        budget = (budget - used) * 3 / 4 - table
+        if (budget <= 0):
+            raise ValueError("memory budget leaves no room for postings next to the "
+                             "%d bytes of the table of %d documents" % (table, len(docs)))
+        folder = tempfile.mkdtemp(prefix="admiral-runs-",
+                                  dir=filepath and os.path.dirname(os.path.abspath(filepath)))
+        runs = []
+        try:
+            percent = 0
+            count = 0
+            for d in docs:
+                count += 1
+                self.add_document(d)
+                if (self.get_buffer_size() > budget):
+                    runs.append(self.write_run(folder, len(runs)))
+                self.progress = float(count) / len(docs)
+                if (int(self.progress * 100) > percent):
+                    percent = int(self.progress * 100)
+                    print "%d%% done, %d runs written." % (percent, len(runs))
+            if (self.index or not runs):
+                runs.append(self.write_run(folder, len(runs)))
+            print "\n"
+            self.doc_count = len(self.manifest)
+            if filepath is None:
+                filepath = os.path.join(folder, "index.segment")
+            self.merge_runs(runs, filepath)
+            # the table of the documents is read from the segment
+            self.filenames = [None]
+            self.manifest = {}
+            self.load_segment(filepath)
+        finally:
+            # a temporary segment stays mapped after it is removed
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def get_buffer_size(self):
+        """ method to estimate the memory used by the postings in the
+            hash map while the index is built
+
+            Returns:
+                size in bytes
+        """
+        return TERM_BYTES * len(self.index) + WORD_BYTES * self.buffered_words
+
+    def write_run(self, folder, number):
+        """ method to write the postings in the hash map to a run file
+            and to empty the hash map
+
+            Parameters:
+                folder -- the folder to write the run file to
+                number -- the number of the run
+
+            Returns:
+                path of the run file
+        """
+        path = os.path.join(folder, "run%05d" % number)
+        Segment.write_run(path, self.index)
+        self.index = {}
+        self.buffered_words = 0
+        return path
+
+    def merge_runs(self, runs, filepath):
+        """ method to merge the runs of a build into a segment file.
+            at most MERGE_FANIN runs are read at the same time, if
+            there are more the neighbouring runs are merged into larger
+            runs first, which keeps them in document id order. the lists
+            of the terms are scored once they are complete
+
+            Parameters:
+                runs     -- paths of the run files in the order they
+                            were written
+                filepath -- the segment file to write
+        """
+        level = 0
+        while (len(runs) > MERGE_FANIN):
+            level += 1
+            merged = []
+            for start in range(0, len(runs), MERGE_FANIN):
+                group = runs[start:start + MERGE_FANIN]
+                if (len(group) == 1):
+                    merged.append(group[0])
+                    continue
+                path = os.path.join(os.path.dirname(group[0]),
+                                    "merge%d-%05d" % (level, len(merged)))
+                Segment.write_run_entries(path, self.read_runs(group))
+                for run in group: os.remove(run)
+                merged.append(path)
+            runs = merged
+        doc_count = float(self.doc_count)
+        writer = Segment.SegmentWriter(filepath)
+        try:
+            for entry in self.read_runs(runs):
+                self.write_postings(writer, entry, doc_count)
+            writer.close(self.filenames, self.manifest, self.doc_count)
+        finally:
+            writer.remove()
+
+    def read_runs(self, runs):
+        """ method to read several runs term by term, the next term is
+            taken from a heap. the lists of a term found in several runs
+            are appended in the order of the runs, which are in document
+            id order
+
+            Parameters:
+                runs -- paths of the run files in the order they were
+                        written
+
+            Returns:
+                generator of (term, Postings.PostingList) tuples in the
+                order of the terms
+        """
+        def read(number, run):
+            # the number of the run keeps lists of the same term apart
+            for key,postings in Segment.read_run(run):
+                yield key,number,postings
+        entries = [read(number, run) for number,run in enumerate(runs)]
+        current = None
+        for key,number,postings in heapq.merge(*entries):
+            if (current is not None and key == current[0]):
+                current[1].extend(postings)
+                continue
+            if current is not None: yield current
+            current = (key, postings)
+        if current is not None: yield current
+
+    def write_postings(self, writer, entry, doc_count):
+        """ method to score a merged posting list and to add it to the
+            segment
+
+            Parameters:
+                writer    -- the Segment.SegmentWriter to add to
+                entry     -- tuple of the term and its posting list
+                doc_count -- number of documents in the index
+        """
+        key,postings = entry
+        #tf.idf = tf * log (N / df)
+        postings.compute_scores(log(doc_count/len(postings),10))
+        writer.add(key, postings)
+
+    def add_document(self,doc):
+        """ method to parse a document and add its words to the index
+
+            Parameters:
+                doc -- the filename of the document relative to the folder
+
+            Returns:
+                the document id assigned to the document
+        """
+        state = self.parser.get_file_state(doc) or (0, 0)
+        digest = hashlib.md5()
+        docid,words = self.parser.parse_file(doc, digest)
+        self.set_filename(docid, doc)
+        self.buffered_words += add_words(self.index, docid, words)
+        self.manifest[doc] = (docid,) + state + (digest.digest(),)
+        return docid
+
+    def update_index(self):
+        """ method to bring the index up to date with the folder.
+            only files whose size or modification time changed and
+            whose content hash differs are parsed again, postings of
+            removed and changed files are deleted.
+
+            the new index is built next to the served one, which is
+            replaced at once when the new one is complete. only one
+            update runs at a time
+
+            Returns:
+                tuple of the number of (added, changed, removed) files
+        """
+        with self.updating:
+            update = IndexManager(self.parser.folder, walk=False,
+                                  compress=self.compress, shard=self.parser.shard,
+                                  impacts=self.impacts is not None)
+            update.parser.doccounter = self.parser.doccounter
+            update.filenames = list(self.filenames)
+            update.manifest = dict(self.manifest)
+            # the finalized lists are collected in a hash map again, lists
+            # of a mapped segment are decoded and compressed ones expanded.
+            # the served lists are copied, searches still read them
+            for key,postings in itertools.izip(self.terms, self.postings):
+                if isinstance(postings, Postings.CompressedPostingList):
+                    postings = postings.decompress()
+                else:
+                    postings = postings.copy()
+                update.index[key] = postings
+            counts = update.apply_changes()
+            update.finalize()
+            self.publish(update)
+            return counts
+
+    def apply_changes(self):
+        """ method to bring the hash map of the index up to date
+            with the folder, for update_index
+
+            Returns:
+                tuple of the number of (added, changed, removed) files
+        """
+        docs = self.parser.scan()
+        current = set(docs)
+        stale = set()
+        removed = 0
+        for doc,entry in self.manifest.items():
+            if doc not in current:
+                stale.add(entry[0])
+                del self.manifest[doc]
+                self.filenames[entry[0]] = None
+                removed += 1
+        added = []
+        changed = []
+        for doc in docs:
+            entry = self.manifest.get(doc)
+            if entry is None:
+                added.append(doc)
+                continue
+            state = self.parser.get_file_state(doc)
+            if (state is None or state == entry[1:3]): continue
+            if (self.parser.get_file_hash(doc) == entry[3]):
+                # only touched, keep the postings
+                self.manifest[doc] = entry[:1] + state + entry[3:]
+                continue
+            stale.add(entry[0])
+            self.filenames[entry[0]] = None
+            changed.append(doc)
+        if stale:
+            for key,postings in self.index.items():
+                if (postings.remove(stale) == 0):
+                    del self.index[key]
+        # new document ids are always the highest, so the
+        # postings stay sorted
+        for doc in added + changed:
+            self.add_document(doc)
+        self.doc_count = len(self.manifest)
+        return len(added),len(changed),removed
+
+    def publish(self, update):
+        """ method to serve the finalized index of another
+            IndexManager, once no search is running
+
+            Parameters:
+                update -- the IndexManager holding the new index
+        """
+        self.lock.acquire_write()
+        try:
+            self.terms = update.terms
+            self.postings = update.postings
+            self.impacts = update.impacts
+            self.filenames = update.filenames
+            self.manifest = update.manifest
+            self.doc_count = update.doc_count
+            self.parser.doccounter = update.parser.doccounter
+            self.completions = update.completions
+            self.generation = generations.next()
+        finally:
+            self.lock.release_write()
+
+    def finalize(self):
+        """ method to finish the index after all documents have been
+            added. the idf is computed once per term and the tf.idf
+            weights of all postings are precomputed from it, or the
+            lists are compressed together with their idf. the words
+            get their term ids and the hash map is emptied. the
+            completion trie is built as well.
+        """
+        doc_count = float(self.doc_count)
+        keys = self.index.keys()
+        keys.sort()
+        self.postings = []
+        for key in keys:
+            postings = self.index.pop(key)
             #tf.idf = tf * log (N / df)
-            self.index[key][doc]['tf.idf'] = (float(self.index[key][doc]['tf'])
-                                              * log(self.doc_count/len(self.index[key]),10))
+            idf = log(doc_count/len(postings),10)
+            if self.compress:
+                postings = Postings.CompressedPostingList(postings, idf)
+            else:
+                postings.compute_scores(idf)
+            self.postings.append(postings)
+        self.terms = Terms.build_dictionary(keys)
+        self.order_impacts()
+        self.build_completions()
+        self.generation = generations.next()
+
+    def set_global_statistics(self, doc_count, frequencies):
+        """ method to compute the scores of a shard with the statistics
+            of the whole collection, so that the scores of all shards
+            can be compared. the shard has to be finalized
+
+            Parameters:
+                doc_count   -- number of documents in all shards
+                frequencies -- hash map of the form { key : df } with
+                               the document frequencies in all shards
+        """
+        doc_count = float(doc_count)
+        # the scores are changed in place, so no search may run
+        self.lock.acquire_write()
+        try:
+            for key,postings in itertools.izip(self.terms, self.postings):
+                postings.compute_scores(log(doc_count/frequencies[key],10))
+            self.order_impacts()
+            self.generation = generations.next()
+        finally:
+            self.lock.release_write()
+
+    def order_impacts(self):
+        """ method to order the postings of every term by their score,
+            if the impact ordered lists are kept. has to be called
+            whenever the scores change
+        """
+        if self.impacts is None: return
+        self.impacts = [Postings.ImpactList(p) for p in self.postings]
+
+    def set_filename(self, doc, filename):
+        """ method to record the name of a document, unless it is
+            already known
+
+            Parameters:
+                doc      -- the document id
+                filename -- the actual name of the document
+        """
+        if (doc < len(self.filenames) and self.filenames[doc] is not None): return
+        if (doc >= len(self.filenames)):
+            self.filenames.extend([None] * (doc + 1 - len(self.filenames)))
+        self.filenames[doc] = filename
 
+    def get_term_id(self,key):
+        """ method to get the id of a keyword
+
+            Parameters:
+                key -- the keyword to look up
+
+            Returns:
+                the term id or -1 if the keyword is not in the index
+        """
+        return self.terms.find(key.lower())
+
+    @reading
     def get_documents(self,key):
         """ method to get documents which contain the given
             key
@@ -106,14 +702,13 @@ class IndexManager:
                 key -- the keyword to get the documents for
 
             Returns:
-                array of document IDs for the given key
+                posting list of document IDs for the given key
         """
-        try:
-            documents = self.index[key.lower()]
-            return documents
-        except Exception, e:
-            return -1
+        termid = self.get_term_id(key)
+        if (termid == -1): return -1
+        return self.postings[termid]
 
+    @reading
     def get_intersected_list(self,keywords):
         """ method to get the intersected documents list for
             the keywords provided in the array
@@ -122,27 +717,22 @@ class IndexManager:
                 keywords -- array of keywords to search for
 
             Returns:
-                intersected list of keywords
+                hash map of the form { filename : docid } for the
+                documents containing all keywords, -1 if one of the
+                keywords is not in the index
         """
-        # list to start intersection with
-        firstkeyword = keywords.pop(0)
-        comparelist = self.get_documents(firstkeyword)
-        lookuplist = self.get_documents(firstkeyword)
-        if  (comparelist == -1):
-            return -1
-        # list to later hold the actual filenames
-        returnlist = {}
+        lists = []
         for key in keywords:
             docs = self.get_documents(key)
             if (docs == -1): return -1
-            comparelist = filter(comparelist.has_key, docs.keys())
-        for c in comparelist:
-            # create hashmap with filename and score
+            lists.append(docs)
+        # list to later hold the actual filenames
+        returnlist = {}
+        for c in Postings.intersect(lists):
             returnlist[self.filenames[c]] = c
-        # fix to keep mutable keyword list consistent
-        keywords.append(firstkeyword)
         return returnlist
 
+    @reading
     def prefix_search(self,prefix):
         """ method to do prefix search in the inverted index
 
@@ -154,7 +744,7 @@ class IndexManager:
         """
         result = []
         # find first element with prefix
-        first_position = bisect.bisect(self.index_keys,prefix)
+        first_position = bisect.bisect(self.terms,prefix)
         # get last character
         last_element = prefix[len(prefix) - 1]
         # cut off last character
@@ -162,15 +752,54 @@ class IndexManager:
         # add the next character in the ascii table
         prefix += chr(ord(last_element) + 1)
         # search for the last element and get the position left to it
-        last_position = bisect.bisect_left(self.index_keys,prefix)
+        last_position = bisect.bisect_left(self.terms,prefix)
         # if both positions are equal, the prefix was not found
         if (first_position == last_position):
             return -1
         else:
             for i in range(first_position,last_position):
-                result.append(self.index_keys[i])
+                result.append(self.terms[i])
             return result
 
+    def build_completions(self):
+        """ method to build the completion trie of the finalized index,
+            before the index is served. the shards don't complete
+            prefixes, the ShardedIndex does it for all of them
+        """
+        self.completions = None
+        if self.parser.shard is None:
+            self.completions = Completion.CompletionTrie(self.terms,
+                                                         self.get_document_frequencies(),
+                                                         MAX_COMPLETIONS)
+
+    @reading
+    def get_completions(self,prefix,limit=None):
+        """ method to get the most frequent terms starting with a
+            prefix from the completion trie
+
+            Parameters:
+                prefix -- the prefix to complete
+                limit  -- maximum number of completions, at most
+                          MAX_COMPLETIONS
+
+            Returns:
+                list of (term, document frequency) tuples
+        """
+        if self.completions is None: return []
+        return self.completions.complete(prefix.lower(), limit)
+
+    @reading
+    def get_document_frequencies(self):
+        """ method to get the document frequencies of all terms
+
+            Returns:
+                array of the document frequencies indexed by term id
+        """
+        if not isinstance(self.postings, list):
+            return self.postings.get_document_frequencies()
+        return array('i', [len(postings) for postings in self.postings])
+
+    @reading
     def k_way_merge(self,keywords):
         """ method to do a k-way merger
         """
@@ -178,7 +807,7 @@ class IndexManager:
         retlist = []
         if keywords == -1: return -1
         for k in keywords:
-            docmap.extend(self.get_documents(k).keys())
+            docmap.extend(self.get_documents(k))
 
         heapq.heapify(docmap)
         actual_item = None
@@ -197,72 +826,346 @@ class IndexManager:
 
         return retnames
 
-    def get_andish_retrieval(self,keywords):
+    @reading
+    def get_andish_retrieval(self,keywords,limit=None,offset=0):
         """ method to do and-ish retrieval with scores
 
             Parameters:
                 keywords -- array of keywords
+                limit    -- maximum number of results to return, all
+                            results are returned if this is None
+                offset   -- number of best results to skip
 
             Returns:
                 list of unioned search result, ordered by tf.idf score
         """
-        # list for first keyword to start with
-        ## get documents in the form of
-        # { docname : score }
+        if (limit is not None and self.impacts is not None):
+            termids = [t for t in map(self.get_term_id, keywords) if (t != -1)]
+            # every document read from the impact ordered lists is looked
+            # up in all lists, which only pays off if few are needed
+            size = sum([len(self.impacts[t]) for t in termids])
+            cost = IMPACT_COST
+            if self.vectorize: cost = IMPACT_VECTOR_COST
+            if (cost * (offset + limit) * len(termids) < size):
+                return self.get_impact_retrieval(termids,limit,offset)
+        # get the rest of the gang
+        lists = [docs for docs in map(self.get_documents, keywords) if (docs != -1)]
+        size = sum([len(docs) for docs in lists])
+        self.evaluated += size
+        if (self.vectorize and
+            size >= VECTOR_MIN + len(self.filenames) / VECTOR_DENSITY):
+            return self.get_vectorized_retrieval(lists,limit,offset)
+        ## accumulate the scores in the form of
+        # { docid : score }
         resultlist = {}
-        comparelist = {}
 
+        for docs in lists:
+            for d,score in docs.iter_scores():
+                if (d in resultlist):
+                    resultlist[d] += score
+                else:
+                    resultlist[d] = score
+        return self.rank_results(resultlist, limit, offset)
+
+    def get_vectorized_retrieval(self,lists,limit=None,offset=0):
+        """ method to do and-ish retrieval with scores using numpy.
+            the scores are added up in an array indexed by document id
+            and only the best offset+limit of them are ordered. the
+            results are the same as the ones of the hash map
+
+            Parameters:
+                lists  -- array of the posting lists of the keywords
+                limit  -- maximum number of results to return, all
+                          results are returned if this is None
+                offset -- number of best results to skip
+
+            Returns:
+                list of (filename, score) tuples, ordered by tf.idf score
+        """
+        scores = numpy.zeros(len(self.filenames))
+        found = numpy.zeros(len(self.filenames), dtype=bool)
+        for docs in lists:
+            docids = numpy.frombuffer(docs.docids, dtype='i')
+            # the ids of a list are distinct, so its scores are added in
+            # one step, in the order of the keywords like in the hash map
+            scores[docids] += numpy.frombuffer(docs.scores, dtype='d')
+            found[docids] = True
+        docids = numpy.flatnonzero(found)
+        scores = scores[docids]
+        if limit is not None:
+            count = offset + limit
+            if (count <= 0): return []
+            if (count < len(docids)):
+                # the best scores are selected without ordering them,
+                # documents with the lowest one of them are all kept to
+                # be ordered by id
+                lowest = scores[numpy.argpartition(-scores, count - 1)[count - 1]]
+                best = scores >= lowest
+                docids = docids[best]
+                scores = scores[best]
+        # documents with the same score are ordered by their id, the
+        # highest first
+        order = numpy.lexsort((docids, scores))[::-1]
+        if limit is None: order = order[offset:]
+        else: order = order[offset:offset+limit]
+        filenames = self.filenames
+        return [(filenames[d],score) for d,score in
+                itertools.izip(docids[order].tolist(), scores[order].tolist())]
+
+    def get_impact_retrieval(self,termids,limit,offset=0):
+        """ method to do and-ish retrieval with scores on the impact
+            ordered lists. only the postings with the highest scores
+            are read, until the best offset+limit documents are known.
+            the results are the same as the ones of the exhaustive
+            retrieval
+
+            Parameters:
+                termids -- array of the term ids of the keywords
+                limit   -- maximum number of results to return
+                offset  -- number of best results to skip
+
+            Returns:
+                list of (filename, score) tuples, ordered by tf.idf score
+        """
+        lists = [self.postings[t] for t in termids]
+        impacts = [self.impacts[t] for t in termids]
+        top,evaluated = Postings.top_scores(lists, impacts, offset + limit)
+        self.evaluated += evaluated
+        return [(self.filenames[d],score) for score,d in top[offset:]]
+
+    @reading
+    def get_batch_retrieval(self,queries,limit=None):
+        """ method to do and-ish retrieval for many queries at once.
+            every distinct keyword is looked up and its postings are
+            decoded only once, their scores are added to all queries
+            containing the keyword
+
+            Parameters:
+                queries -- list of arrays of keywords
+                limit   -- maximum number of results per query, all
+                           results are returned if this is None
+
+            Returns:
+                list of the results of the queries in their order, each
+                a list of (filename, score) tuples ordered by score
+        """
+        ## the number of queries every keyword occurs in, in the form of
+        # { key : count }
+        occurrences = {}
+        documents = {}
+        results = [None] * len(queries)
+        keylists = [None] * len(queries)
+        for number,keywords in enumerate(queries):
+            keys = [key.lower() for key in keywords]
+            for key in keys:
+                if key not in documents: documents[key] = self.get_documents(key)
+            if self.vectorize:
+                # queries over many postings are answered with numpy,
+                # with the lists looked up for the batch
+                lists = [documents[key] for key in keys if (documents[key] != -1)]
+                if (sum([len(docs) for docs in lists]) >=
+                    VECTOR_MIN + len(self.filenames) / VECTOR_DENSITY):
+                    results[number] = self.get_vectorized_retrieval(lists,limit)
+                    continue
+            keylists[number] = keys
+            for key in keys:
+                occurrences[key] = occurrences.get(key, 0) + 1
+        # the decoded postings of keywords in several queries, kept
+        # until their last query was scored
+        decoded = {}
+        for number,keys in enumerate(keylists):
+            if keys is None: continue
+            ## the scores are added in the order of the keywords like
+            # in get_andish_retrieval, so that the sums are the same
+            # { docid : score }
+            resultlist = {}
+            for key in keys:
+                docs = documents[key]
+                if (docs == -1): continue
+                occurrences[key] -= 1
+                if key in decoded:
+                    scores = decoded[key]
+                    if (occurrences[key] == 0): del decoded[key]
+                elif (occurrences[key] > 0):
+                    scores = decoded[key] = list(docs.iter_scores())
+                else:
+                    scores = docs.iter_scores()
+                if not resultlist:
+                    resultlist.update(scores)
+                    continue
+                for d,score in scores:
+                    if (d in resultlist):
+                        resultlist[d] += score
+                    else:
+                        resultlist[d] = score
+            results[number] = self.rank_results(resultlist, limit)
+        return results
+
+    def rank_results(self,resultlist,limit=None,offset=0):
+        """ method to order scored documents by their score
+
+            Parameters:
+                resultlist -- hash map of the form { docid : score }
+                limit      -- maximum number of results to return, all
+                              results are returned if this is None
+                offset     -- number of best results to skip
+
+            Returns:
+                list of (filename, score) tuples ordered by score
+        """
+        # documents with the same score are ordered by their id, the
+        # highest first
+        scored = itertools.izip(resultlist.itervalues(), resultlist.iterkeys())
+        if limit is None:
+            sorted_results = sorted(scored, reverse=True)[offset:]
+        else:
+            # only the best offset+limit results have to be ordered,
+            # which a bounded heap does without sorting everything
+            sorted_results = heapq.nlargest(offset + limit, scored)[offset:]
+        return [(self.filenames[d],score) for score,d in sorted_results]
+
+    @reading
+    def get_phrase_retrieval(self,keywords,limit=None,offset=0):
+        """ method to search for documents containing the keywords
+            as a phrase, e.g. in the given order and next to each other.
+            only the word positions stored in the index are used, the
+            documents are not read again
+
+            Parameters:
+                keywords -- array of the keywords of the phrase
+                limit    -- maximum number of results to return, all
+                            results are returned if this is None
+                offset   -- number of best results to skip
+
+            Returns:
+                list of (filename, score) tuples of the documents
+                containing the phrase, ordered by tf.idf score
+        """
+        lists = []
         for key in keywords:
-            # get the rest of the gang
             docs = self.get_documents(key)
-            if (docs == -1): continue
-            for d in docs:
-                name = self.filenames[d]
-                if (resultlist.has_key(name)):
-                    resultlist[name] += docs[d]['tf.idf']
-                else:
-                    resultlist[name] = docs[d]['tf.idf']
+            if (docs == -1): return []
+            lists.append(docs)
+        resultlist = {}
+        for d in Postings.intersect_phrase(lists):
+            resultlist[d] = sum([docs.get_score(d) for docs in lists])
+        return self.rank_results(resultlist, limit, offset)
 
-        sorted_results = sorted(resultlist.items(), key=itemgetter(1))
-        sorted_results.reverse()
-        return sorted_results
+    @reading
+    def get_document_count(self):
+        """ method to get the number of indexed documents
 
+            Returns:
+                number of documents
+        """
+        return self.doc_count
 
+    @reading
     def get_index_size(self):
         """ method to get length of the index
 
             Returns:
                 length of index
         """
-        return len(self.index)
+        return len(self.terms)
+
+    @reading
+    def get_memory_usage(self):
+        """ method to get the memory used by the posting lists
+            and the term dictionary
+
+            Returns:
+                tuple of (bytes, number of postings, bytes per posting)
+        """
+        size = sys.getsizeof(self.postings) + self.terms.get_memory_usage()
+        count = 0
+        for postings in self.postings:
+            size += postings.get_memory_usage()
+            count += len(postings)
+        if self.impacts is not None:
+            size += sys.getsizeof(self.impacts)
+            for impacts in self.impacts:
+                size += impacts.get_memory_usage()
+        if (count == 0): return size,0,0.0
+        return size,count,float(size)/count
 
     def get_index(self):
-        """ get the index object
+        """ get the posting lists, indexed by term id
         """
-        return self.index
+        return self.postings
+
+    @reading
+    def get_two_word_one_doc(self,limit=None):
+        """ method to find pairs of words which are contained in
+            exactly one document together
 
-    def get_two_word_one_doc(self):
-        """ O(n^2) implementation to find exactly one document to contain
-            two words.
+            Parameters:
+                limit -- maximum number of pairs to return
+
+            Returns:
+                list of [filename, word, word] entries
         """
-        result = []
-        for i in self.index.keys():
-            for u in self.index.keys():
-                intlist = self.get_intersected_list([i,u])
-                if (len(intlist) == 1):
-                    result.append([intlist[0],i,u])
-        return result
+        return [list(p) for p in
+                itertools.islice(self.iter_two_word_one_doc(), limit)]
+
+    def iter_two_word_one_doc(self):
+        """ generator for the pairs of words which are contained in
+            exactly one document together. the words are processed
+            in the order of their document frequency, every word is
+            only paired with the less selective words occurring in
+            its documents, so every pair is looked at once and only
+            pairs actually sharing a document are counted.
 
+            Returns:
+                (filename, word, word) tuples, one at a time
+        """
+        dfs = self.get_document_frequencies()
+        # term ids ordered by document frequency, ties in the order
+        # of the terms
+        order = sorted(xrange(len(self.terms)), key=lambda i: (dfs[i], i))
+        # forward index of the form { docid : [ rank, ... ] } where
+        # rank is the position of the word in the order above
+        forward = {}
+        for rank,termid in enumerate(order):
+            for d in self.postings[termid]:
+                try:
+                    forward[d].append(rank)
+                except KeyError:
+                    forward[d] = array('i', [rank])
+        terms = self.terms
+        for rank,termid in enumerate(order):
+            docids = self.postings[termid].docids
+            term = terms[termid]
+            if (len(docids) == 1):
+                # a word in one document forms a pair with all
+                # the other words of that document
+                d = docids[0]
+                ranks = forward[d]
+                for other in ranks[bisect.bisect_right(ranks, rank):]:
+                    yield self.filenames[d],term,terms[order[other]]
+                continue
+            # count the shared documents of the pairs, remembering
+            # the document for pairs shared only once
+            shared = {}
+            for d in docids:
+                ranks = forward[d]
+                for other in ranks[bisect.bisect_right(ranks, rank):]:
+                    if other in shared: shared[other] = None
+                    else: shared[other] = d
+            for other in sorted(shared):
+                d = shared[other]
+                if d is not None:
+                    yield self.filenames[d],term,terms[order[other]]
+
+    @reading
     def get_word_frequencies(self):
         """ create object with frequencies of word occurrences
 
             Returns:
                 dictionary with word occurrences, sorted
         """
-        occurrences = {}
-        for key in self.index.keys():
-            occurrences[key] = len(self.index[key])
-        sorted_occurrences = sorted(occurrences.items(), key=itemgetter(1))
+        occurrences = itertools.izip(self.terms, self.get_document_frequencies())
+        sorted_occurrences = sorted(occurrences, key=itemgetter(1))
         return sorted_occurrences
 
     def dump_objects(self,path):
@@ -271,8 +1174,7 @@ class IndexManager:
             Parameters:
                 path -- filepath where to dump objects
         """
-        self.parser.write_object_to_disk(path+"index.pickle",self.index)
-        self.parser.write_object_to_disk(path+"filenames.pickle",self.filenames)
+        self.write_segment(path+"index.segment")
 
     def read_objects(self,path):
         """ method to read objects from disk
@@ -280,5 +1182,35 @@ class IndexManager:
             Parameters:
                 path -- filepath from where to read objects
         """
-        self.index = self.parser.read_object_from_disk(path+"index.pickle")
-        self.filenames = self.parser.read_object_from_disk(path+"filenames.pickle")
+        self.load_segment(path+"index.segment")
+
+    @reading
+    def write_segment(self,filepath):
+        """ method to write the finalized index to a binary
+            segment file
+
+            Parameters:
+                filepath -- the file to write the segment to
+        """
+        Segment.write_segment(filepath, self.terms, self.postings,
+                              self.filenames, self.manifest, self.doc_count)
+
+    def load_segment(self,filepath):
+        """ method to serve the index from a segment file. the file
+            is mapped into memory and posting lists are only decoded
+            when they are looked up
+
+            Parameters:
+                filepath -- the segment file to load
+        """
+        segment = Segment.SegmentReader(filepath)
+        self.index = {}
+        self.postings = segment
+        self.terms = segment.terms
+        self.filenames = segment.filenames
+        self.manifest = segment.manifest
+        self.doc_count = segment.doc_count
+        self.order_impacts()
+        self.build_completions()
+        self.generation = generations.next()
+        self.parser.doccounter = len(self.filenames) - 1
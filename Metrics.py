@@ -0,0 +1,148 @@
+"""
+File: Metrics.py
+Description: request metrics of the webserver in the prometheus
+             text exposition format
+"""
+import threading
+import bisect
+
+# upper bounds of the latency buckets in seconds
+BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+class Histogram:
+    """ class counting observations in cumulative buckets
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """ method to add an observation """
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        """ method to get the lines of the histogram
+
+            Parameters:
+                name   -- name of the metric
+                labels -- label string without braces
+
+            Returns:
+                list of lines in the text exposition format
+        """
+        lines = []
+        cumulative = 0
+        for i in range(len(BUCKETS)):
+            cumulative += self.counts[i]
+            lines.append('%s_bucket{%s,le="%s"} %s' % (name, labels, BUCKETS[i], cumulative))
+        lines.append('%s_bucket{%s,le="+Inf"} %s' % (name, labels, self.count))
+        lines.append('%s_sum{%s} %r' % (name, labels, self.sum))
+        lines.append('%s_count{%s} %s' % (name, labels, self.count))
+        return lines
+
+class ActionMetrics:
+    """ class holding the metrics of a single action
+    """
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency = Histogram()
+        self.lookup = Histogram()
+        self.render = Histogram()
+
+class Timer:
+    """ context manager adding the time spent in it to the index
+        lookup time of the current request
+    """
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def __enter__(self):
+        self.start = self.metrics.clock()
+
+    def __exit__(self, *args):
+        local = self.metrics.local
+        local.lookup = getattr(local, "lookup", 0.0) + self.metrics.clock() - self.start
+
+class Metrics:
+    """ class collecting the metrics of all actions. the index lookup
+        time of a request is collected per thread, everything not spent
+        in lookups is counted as rendering time.
+    """
+    def __init__(self, clock):
+        """ constructor method
+
+            Parameters:
+                clock -- function returning the current time in seconds
+        """
+        self.clock = clock
+        self.actions = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def start_request(self):
+        """ method to reset the lookup time of the current thread """
+        self.local.lookup = 0.0
+
+    def lookup(self):
+        """ method to get a context manager timing an index lookup """
+        return Timer(self)
+
+    def observe(self, action, seconds, size, error):
+        """ method to record a finished request
+
+            Parameters:
+                action  -- name of the action
+                seconds -- time spent answering the request
+                size    -- number of bytes of the response
+                error   -- whether the request failed
+        """
+        lookup = min(getattr(self.local, "lookup", 0.0), seconds)
+        with self.lock:
+            metrics = self.actions.get(action)
+            if metrics is None:
+                metrics = self.actions[action] = ActionMetrics()
+            metrics.requests += 1
+            if error: metrics.errors += 1
+            metrics.bytes += size
+            metrics.latency.observe(seconds)
+            metrics.lookup.observe(lookup)
+            metrics.render.observe(seconds - lookup)
+
+    def render(self, gauges={}):
+        """ method to get all metrics in the text exposition format
+
+            Parameters:
+                gauges -- further values in the form { name : value }
+
+            Returns:
+                the metrics as string
+        """
+        lines = []
+        with self.lock:
+            actions = sorted(self.actions.items())
+            for name,kind,text,field in [
+                    ("admiral_requests_total", "counter", "Requests answered per action.", "requests"),
+                    ("admiral_request_errors_total", "counter", "Failed requests per action.", "errors"),
+                    ("admiral_response_bytes_total", "counter", "Bytes sent per action.", "bytes")]:
+                lines.append("# HELP %s %s" % (name, text))
+                lines.append("# TYPE %s %s" % (name, kind))
+                for action,metrics in actions:
+                    lines.append('%s{action="%s"} %s' % (name, action, getattr(metrics, field)))
+            for name,text,field in [
+                    ("admiral_request_duration_seconds", "Time to answer a request.", "latency"),
+                    ("admiral_lookup_duration_seconds", "Time spent in index lookups.", "lookup"),
+                    ("admiral_render_duration_seconds", "Time spent rendering responses.", "render")]:
+                lines.append("# HELP %s %s" % (name, text))
+                lines.append("# TYPE %s histogram" % (name))
+                for action,metrics in actions:
+                    lines.extend(getattr(metrics, field).render(name, 'action="%s"' % action))
+        for name in sorted(gauges):
+            lines.append("# TYPE %s gauge" % (name))
+            lines.append("%s %s" % (name, gauges[name]))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,727 @@
+"""
+@file Postings.py
+@brief compact array backed posting lists for the inverted index
+@version 0.1
+"""
+
+import sys
+import heapq
+import bisect
+from array import array
+from itertools import izip
+import Codec
+
+# minimum ratio of the list lengths to use galloping search
+GALLOP_RATIO = 8
+# number of postings compressed together in a block
+BLOCK_SIZE = 128
+
+def intersect(lists):
+    """ function to intersect posting lists. the lists are processed
+        from the shortest to the longest and the intersection stops as
+        soon as it is empty. every list filters the documents of the
+        running intersection in the way suited best to its layout
+
+        Parameters:
+            lists -- list of posting lists
+
+        Returns:
+            array of the document ids contained in all lists
+    """
+    if not lists: return array('i')
+    lists = sorted(lists, key=len)
+    result = lists[0].docids
+    for other in lists[1:]:
+        result = other.intersect_sorted(result)
+        if not result: break
+    return result
+
+def intersect_phrase(lists):
+    """ function to find the documents containing the terms of a
+        phrase next to each other. the documents containing all terms
+        are intersected first, only their positions are decoded
+
+        Parameters:
+            lists -- list of posting lists in the order of the phrase
+
+        Returns:
+            array of the document ids containing the phrase
+    """
+    matches = array('i')
+    if not lists: return matches
+    for doc in intersect(lists):
+        positions = [postings.get_positions(postings.find(doc)) for postings in lists]
+        # start with the term occurring least often in the document
+        order = sorted(range(len(lists)), key=lambda i: len(positions[i]))
+        first = order[0]
+        # positions the phrase would have to start at
+        starts = set(p - first for p in positions[first])
+        for i in order[1:]:
+            starts.intersection_update(p - i for p in positions[i])
+            if not starts: break
+        if starts: matches.append(doc)
+    return matches
+
+class PostingList(object):
+    """ Class holding the postings of a single term
+
+        instead of a hash map per document the postings are
+        kept in three parallel arrays, sorted by document id
+
+        docids = array('i', [ doc, ... ])
+        tfs    = array('i', [ tf, ... ])
+        scores = array('d', [ tf.idf, ... ])
+
+        the word positions of all postings are variable byte encoded
+        into a single buffer. the tf positions of a posting start at
+        its offset, the first one absolute and the others as the gap
+        to the one before
+
+        positions        = bytearray(...)
+        position_offsets = array('I', [ offset, ... ])
+    """
+    __slots__ = ('docids', 'tfs', 'scores', 'positions', 'position_offsets',
+                 'last_position')
+
+    def __init__(self):
+        """ Constructor which creates the empty arrays
+        """
+        self.docids = array('i')
+        self.tfs = array('i')
+        self.scores = array('d')
+        self.positions = bytearray()
+        self.position_offsets = array('I')
+        self.last_position = 0
+
+    def add(self, doc, position):
+        """ method to count an occurrence of the term in a document.
+            documents have to be added in ascending order of their id
+            and the occurrences in a document in ascending order of
+            their position, the scores are only valid after
+            compute_scores() was called
+
+            Parameters:
+                doc      -- the document id to add
+                position -- number of words before the occurrence
+
+            Returns:
+                position of the posting in the arrays
+        """
+        i = len(self.docids) - 1
+        if (i >= 0 and self.docids[i] == doc):
+            self.tfs[i] += 1
+            Codec.append_varbyte(self.positions, position - self.last_position)
+        else:
+            self.docids.append(doc)
+            self.tfs.append(1)
+            self.position_offsets.append(len(self.positions))
+            Codec.append_varbyte(self.positions, position)
+            i += 1
+        self.last_position = position
+        return i
+
+    def extend(self, other):
+        """ method to append the postings of another list, all of its
+            document ids have to be greater than the ones in this list
+
+            Parameters:
+                other -- the posting list to append
+        """
+        base = len(self.positions)
+        self.docids.extend(other.docids)
+        self.tfs.extend(other.tfs)
+        self.position_offsets.extend([base + o for o in other.position_offsets])
+        self.positions.extend(other.positions)
+        self.last_position = other.last_position
+
+    def copy(self):
+        """ method to get a copy of the list, which can be changed
+            without changing this one
+
+            Returns:
+                PostingList with the same postings
+        """
+        postings = PostingList()
+        postings.docids = array('i', self.docids)
+        postings.tfs = array('i', self.tfs)
+        postings.scores = array('d', self.scores)
+        postings.positions = bytearray(self.positions)
+        postings.position_offsets = array('I', self.position_offsets)
+        postings.last_position = self.last_position
+        return postings
+
+    def remove(self, docs):
+        """ method to remove the postings of a set of documents
+
+            Parameters:
+                docs -- set of document ids to remove
+
+            Returns:
+                number of remaining postings
+        """
+        keep = [i for i,d in enumerate(self.docids) if d not in docs]
+        if (len(keep) < len(self.docids)):
+            self.docids = array('i', [self.docids[i] for i in keep])
+            self.tfs = array('i', [self.tfs[i] for i in keep])
+            if (len(self.scores) > 0):
+                self.scores = array('d', [self.scores[i] for i in keep])
+            ends = self.position_offsets[1:] + array('I', [len(self.positions)])
+            positions = bytearray()
+            offsets = array('I')
+            for i in keep:
+                offsets.append(len(positions))
+                positions.extend(self.positions[self.position_offsets[i]:ends[i]])
+            self.positions = positions
+            self.position_offsets = offsets
+        return len(self.docids)
+
+    def compute_scores(self, idf):
+        """ method to compute the tf.idf weights of all postings
+
+            Parameters:
+                idf -- inverse document frequency of the term
+        """
+        self.scores = array('d', [tf * idf for tf in self.tfs])
+
+    def find(self, doc):
+        """ method to find the position of a document in the list
+
+            Parameters:
+                doc -- the document id to look for
+
+            Returns:
+                position of the document or -1 if it is not contained
+        """
+        position = bisect.bisect_left(self.docids, doc)
+        if (position < len(self.docids) and self.docids[position] == doc):
+            return position
+        return -1
+
+    def advance(self, position, doc):
+        """ method to find the first position at or after a given
+            position holding a document id not lower than doc. the
+            distance is doubled until doc is passed, then the last
+            step is searched with bisection
+
+            Parameters:
+                position -- position to start the search at
+                doc      -- the document id to look for
+
+            Returns:
+                the position found, len(self) if all ids are lower
+        """
+        docids = self.docids
+        length = len(docids)
+        if (position >= length or docids[position] >= doc): return position
+        step = 1
+        while (position + step < length and docids[position + step] < doc):
+            position += step
+            step *= 2
+        return bisect.bisect_left(docids, doc, position + 1,
+                                  min(position + step + 1, length))
+
+    def intersect_sorted(self, docs):
+        """ method to get the documents of a sorted array which are
+            contained in this list. the documents are looked up with
+            galloping search if this list is much longer, otherwise
+            the list is used as hash set
+
+            Parameters:
+                docs -- array of ascending document ids
+
+            Returns:
+                array of the contained document ids, in ascending order
+        """
+        length = len(self.docids)
+        if (length < GALLOP_RATIO * len(docs)):
+            # filtering keeps the ids of the running intersection sorted
+            return array('i', filter(set(self.docids).__contains__, docs))
+        matches = array('i')
+        position = 0
+        for doc in docs:
+            position = self.advance(position, doc)
+            if (position >= length): break
+            if (self.docids[position] == doc): matches.append(doc)
+        return matches
+
+    def get_tf(self, doc):
+        """ method to get the term frequency for a document
+
+            Parameters:
+                doc -- the document id
+
+            Returns:
+                term frequency or 0 if the document is not contained
+        """
+        position = self.find(doc)
+        if (position == -1): return 0
+        return self.tfs[position]
+
+    def get_score(self, doc):
+        """ method to get the tf.idf score for a document
+
+            Parameters:
+                doc -- the document id
+
+            Returns:
+                tf.idf score or 0.0 if the document is not contained
+        """
+        position = self.find(doc)
+        if (position == -1): return 0.0
+        return self.scores[position]
+
+    def get_positions(self, i):
+        """ method to decode the word positions of a posting
+
+            Parameters:
+                i -- position of the posting in the arrays
+
+            Returns:
+                ascending list of the positions of the term in the document
+        """
+        return Codec.decode_gaps(self.positions, self.position_offsets[i],
+                                 self.tfs[i])[0]
+
+    def iter_scores(self):
+        """ method to iterate over (docid, tf.idf) tuples
+        """
+        return izip(self.docids, self.scores)
+
+    def get_memory_usage(self):
+        """ method to get the memory used by the posting list
+
+            Returns:
+                size in bytes
+        """
+        return (sys.getsizeof(self) + sys.getsizeof(self.docids)
+                + sys.getsizeof(self.tfs) + sys.getsizeof(self.scores)
+                + sys.getsizeof(self.positions)
+                + sys.getsizeof(self.position_offsets))
+
+    def __len__(self):
+        return len(self.docids)
+
+    def __iter__(self):
+        return iter(self.docids)
+
+    def __contains__(self, doc):
+        return self.find(doc) != -1
+
+    def __getstate__(self):
+        return (self.docids, self.tfs, self.scores, self.positions,
+                self.position_offsets, self.last_position)
+
+    def __setstate__(self, state):
+        (self.docids, self.tfs, self.scores, self.positions,
+         self.position_offsets, self.last_position) = state
+
+class CompressedPostingList(object):
+    """ Class holding the finalized postings of a single term in
+        compressed blocks
+
+        the postings are split into blocks of BLOCK_SIZE postings.
+        every block holds the gaps between its document ids, the
+        first one relative to the last id of the previous block,
+        followed by the term frequencies, all variable byte encoded.
+        the last document id of every block is kept uncompressed,
+        so a lookup only decodes the one block which can contain the
+        document. the scores are computed from the term frequencies
+        and the idf of the term when they are needed
+
+        data            = bytearray(...)
+        block_last      = array('i', [ doc, ... ])
+        block_offsets   = array('I', [ offset into data, ... ])
+        block_positions = array('I', [ offset into positions, ... ])
+        positions       = bytearray(...)
+
+        the lists are read only, decompress() returns a PostingList
+        to be changed
+    """
+    __slots__ = ('length', 'idf', 'data', 'block_last', 'block_offsets',
+                 'block_positions', 'positions')
+
+    def __init__(self, postings, idf=0.0):
+        """ Constructor which compresses a posting list
+
+            Parameters:
+                postings -- the PostingList to compress
+                idf      -- inverse document frequency of the term
+        """
+        self.length = len(postings)
+        self.idf = idf
+        self.data = bytearray()
+        self.block_last = array('i')
+        self.block_offsets = array('I')
+        self.block_positions = array('I')
+        self.positions = postings.positions
+        previous = 0
+        for start in xrange(0, self.length, BLOCK_SIZE):
+            end = min(start + BLOCK_SIZE, self.length)
+            self.block_offsets.append(len(self.data))
+            self.block_positions.append(postings.position_offsets[start])
+            for doc in postings.docids[start:end]:
+                Codec.append_varbyte(self.data, doc - previous)
+                previous = doc
+            for tf in postings.tfs[start:end]:
+                Codec.append_varbyte(self.data, tf)
+            self.block_last.append(previous)
+
+    def decode_block(self, b):
+        """ method to decode a block of postings
+
+            Parameters:
+                b -- number of the block
+
+            Returns:
+                list of the document ids and list of the term frequencies
+        """
+        count = min(BLOCK_SIZE, self.length - b * BLOCK_SIZE)
+        base = 0
+        if (b > 0): base = self.block_last[b-1]
+        docids,offset = Codec.decode_gaps(self.data, self.block_offsets[b], count, base)
+        return docids,Codec.decode_varbytes(self.data, offset, count)[0]
+
+    def decode_docids(self, b):
+        """ method to decode the document ids of a block
+
+            Parameters:
+                b -- number of the block
+
+            Returns:
+                list of the document ids
+        """
+        count = min(BLOCK_SIZE, self.length - b * BLOCK_SIZE)
+        base = 0
+        if (b > 0): base = self.block_last[b-1]
+        return Codec.decode_gaps(self.data, self.block_offsets[b], count, base)[0]
+
+    def decompress(self):
+        """ method to get the postings as changeable PostingList
+
+            Returns:
+                PostingList with the same postings
+        """
+        postings = PostingList()
+        postings.docids = self.docids
+        postings.tfs = self.tfs
+        postings.scores = self.scores
+        postings.positions = bytearray(self.positions)
+        postings.position_offsets = self.position_offsets
+        return postings
+
+    def compute_scores(self, idf):
+        """ method to set the idf the tf.idf weights are computed with
+
+            Parameters:
+                idf -- inverse document frequency of the term
+        """
+        self.idf = idf
+
+    def find(self, doc):
+        """ method to find the position of a document in the list
+
+            Parameters:
+                doc -- the document id to look for
+
+            Returns:
+                position of the document or -1 if it is not contained
+        """
+        b = bisect.bisect_left(self.block_last, doc)
+        if (b >= len(self.block_last)): return -1
+        docids = self.decode_docids(b)
+        position = bisect.bisect_left(docids, doc)
+        if (docids[position] == doc): return b * BLOCK_SIZE + position
+        return -1
+
+    def advance(self, position, doc):
+        """ method to find the first position at or after a given
+            position holding a document id not lower than doc. all
+            blocks ending before doc are skipped without decoding
+
+            Parameters:
+                position -- position to start the search at
+                doc      -- the document id to look for
+
+            Returns:
+                the position found, len(self) if all ids are lower
+        """
+        if (position >= self.length): return position
+        b = bisect.bisect_left(self.block_last, doc, position / BLOCK_SIZE)
+        if (b >= len(self.block_last)): return self.length
+        start = max(0, position - b * BLOCK_SIZE)
+        return b * BLOCK_SIZE + bisect.bisect_left(self.decode_docids(b), doc, start)
+
+    def intersect_sorted(self, docs):
+        """ method to get the documents of a sorted array which are
+            contained in this list. blocks without any of the documents
+            are skipped, every other block is decoded once
+
+            Parameters:
+                docs -- array of ascending document ids
+
+            Returns:
+                array of the contained document ids, in ascending order
+        """
+        matches = array('i')
+        blocks = len(self.block_last)
+        b = -1
+        block = ()
+        for doc in docs:
+            if (b < 0 or doc > self.block_last[b]):
+                b = bisect.bisect_left(self.block_last, doc, b + 1)
+                if (b >= blocks): break
+                block = set(self.decode_docids(b))
+            if doc in block: matches.append(doc)
+        return matches
+
+    def get_tf(self, doc):
+        """ method to get the term frequency for a document
+
+            Parameters:
+                doc -- the document id
+
+            Returns:
+                term frequency or 0 if the document is not contained
+        """
+        position = self.find(doc)
+        if (position == -1): return 0
+        b,i = divmod(position, BLOCK_SIZE)
+        return self.decode_block(b)[1][i]
+
+    def get_score(self, doc):
+        """ method to get the tf.idf score for a document
+
+            Parameters:
+                doc -- the document id
+
+            Returns:
+                tf.idf score or 0.0 if the document is not contained
+        """
+        return self.get_tf(doc) * self.idf
+
+    def get_positions(self, i):
+        """ method to decode the word positions of a posting
+
+            Parameters:
+                i -- position of the posting in the list
+
+            Returns:
+                ascending list of the positions of the term in the document
+        """
+        b,i = divmod(i, BLOCK_SIZE)
+        tfs = self.decode_block(b)[1]
+        start = Codec.skip_varbytes(self.positions, self.block_positions[b], sum(tfs[:i]))
+        return Codec.decode_gaps(self.positions, start, tfs[i])[0]
+
+    def iter_blocks(self):
+        """ generator for the decoded blocks of the list
+
+            Returns:
+                (docids, tfs) tuples of lists, one block at a time
+        """
+        for b in xrange(len(self.block_last)):
+            yield self.decode_block(b)
+
+    def iter_scores(self):
+        """ method to iterate over (docid, tf.idf) tuples
+        """
+        idf = self.idf
+        for docids,tfs in self.iter_blocks():
+            for i in xrange(len(docids)):
+                yield docids[i],tfs[i] * idf
+
+    @property
+    def docids(self):
+        """ array of all document ids, decoded completely """
+        docids = array('i')
+        for b in xrange(len(self.block_last)):
+            docids.extend(self.decode_docids(b))
+        return docids
+
+    @property
+    def tfs(self):
+        """ array of all term frequencies, decoded completely """
+        tfs = array('i')
+        for docids,block in self.iter_blocks():
+            tfs.extend(block)
+        return tfs
+
+    @property
+    def scores(self):
+        """ array of all tf.idf scores, decoded completely """
+        return array('d', [tf * self.idf for tf in self.tfs])
+
+    @property
+    def position_offsets(self):
+        """ array of the offsets of the positions of every posting """
+        offsets = array('I')
+        for b,(docids,tfs) in enumerate(self.iter_blocks()):
+            offset = self.block_positions[b]
+            for tf in tfs:
+                offsets.append(offset)
+                offset = Codec.skip_varbytes(self.positions, offset, tf)
+        return offsets
+
+    def get_memory_usage(self):
+        """ method to get the memory used by the posting list
+
+            Returns:
+                size in bytes
+        """
+        return (sys.getsizeof(self) + sys.getsizeof(self.data)
+                + sys.getsizeof(self.block_last) + sys.getsizeof(self.block_offsets)
+                + sys.getsizeof(self.block_positions) + sys.getsizeof(self.positions))
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for b in xrange(len(self.block_last)):
+            for doc in self.decode_docids(b):
+                yield doc
+
+    def __contains__(self, doc):
+        return self.find(doc) != -1
+
+    def __getstate__(self):
+        return (self.length, self.idf, self.data, self.block_last,
+                self.block_offsets, self.block_positions, self.positions)
+
+    def __setstate__(self, state):
+        (self.length, self.idf, self.data, self.block_last,
+         self.block_offsets, self.block_positions, self.positions) = state
+
+class ImpactList(object):
+    """ Class holding the postings of a single term ordered by their
+        tf.idf score, highest first. the first score is the maximum
+        score of the term, the scores further down bound the scores
+        of all postings behind them
+
+        docids = array('i', [ doc, ... ])
+        scores = array('d', [ tf.idf, ... ])
+
+        postings with the same score are ordered by their document id,
+        the highest first, like ranked results are
+    """
+    __slots__ = ('docids', 'scores')
+
+    def __init__(self, postings):
+        """ Constructor which orders the postings of a scored list
+
+            Parameters:
+                postings -- the PostingList or CompressedPostingList
+                            to order
+        """
+        docids = postings.docids
+        scores = postings.scores
+        # the sort is stable, so postings with the same score stay in
+        # the order of the reversed document ids
+        order = sorted(xrange(len(scores) - 1, -1, -1), key=scores.__getitem__,
+                       reverse=True)
+        self.docids = array('i', [docids[i] for i in order])
+        self.scores = array('d', [scores[i] for i in order])
+
+    def get_max_score(self):
+        """ method to get the highest score of the term
+
+            Returns:
+                the maximum tf.idf score, 0.0 for an empty list
+        """
+        if not self.scores: return 0.0
+        return self.scores[0]
+
+    def get_memory_usage(self):
+        """ method to get the memory used by the list
+
+            Returns:
+                size in bytes
+        """
+        return (sys.getsizeof(self) + sys.getsizeof(self.docids)
+                + sys.getsizeof(self.scores))
+
+    def __len__(self):
+        return len(self.docids)
+
+def top_scores(lists, impacts, k):
+    """ function to find the k documents with the highest sum of
+        scores over the posting lists. the impact ordered lists are
+        read from their highest score down, always from the list
+        with the highest next score. every new document is scored
+        completely by looking it up in the document ordered lists.
+        the next scores of the lists bound the score of all documents
+        not seen yet, so the search stops as soon as the k best
+        scores are higher than that bound. a document not seen yet
+        can only reach the bound if it is next in all lists which
+        still add to it, so its id is not higher than the next ones
+        there. without such lists it is still next in one of the
+        lists not read completely
+
+        the scores are added in the order of the lists, like an
+        exhaustive evaluation does, so both find the same scores.
+        documents with the same score are ordered by their id, the
+        highest first
+
+        Parameters:
+            lists   -- list of document ordered posting lists, a list
+                       given several times is counted several times
+            impacts -- list of the ImpactLists of the lists
+            k       -- number of documents to find
+
+        Returns:
+            list of (score, docid) tuples of the best documents,
+            ordered by score, and the number of postings evaluated
+    """
+    if (k <= 0 or not lists): return [],0
+    # the impact ordered lists of the distinct terms, read from the
+    # one with the highest next score
+    cursors = {}
+    queue = []
+    for n,impact in enumerate(impacts):
+        if (id(impact) not in cursors and len(impact) > 0):
+            cursors[id(impact)] = 0
+            queue.append((-impact.scores[0], n))
+    heapq.heapify(queue)
+    bounds = [impact.get_max_score() for impact in impacts]
+    seen = set()
+    # the best documents found so far, the worst one first
+    top = []
+    evaluated = 0
+    while queue:
+        bound = 0.0
+        for b in bounds:
+            bound += b
+        if (len(top) == k and top[0][0] >= bound):
+            if (top[0][0] > bound): break
+            following = [impacts[i].docids[cursors[id(impacts[i])]]
+                         for i in xrange(len(impacts)) if (bounds[i] > 0.0)]
+            if following: following = min(following)
+            else: following = max([impacts[i].docids[cursors[id(impacts[i])]]
+                                   for n,i in queue])
+            # documents with the same score are ordered by their id
+            if (top[0][1] >= following): break
+        n = heapq.heappop(queue)[1]
+        impact = impacts[n]
+        c = cursors[id(impact)]
+        doc = impact.docids[c]
+        c += 1
+        cursors[id(impact)] = c
+        following = 0.0
+        if (c < len(impact)):
+            following = impact.scores[c]
+            heapq.heappush(queue, (-following, n))
+        for i in xrange(len(impacts)):
+            if (impacts[i] is impact): bounds[i] = following
+        evaluated += 1
+        if doc in seen: continue
+        seen.add(doc)
+        score = 0.0
+        for postings in lists:
+            score += postings.get_score(doc)
+        evaluated += len(lists) - 1
+        entry = (score, doc)
+        if (len(top) < k):
+            heapq.heappush(top, entry)
+        elif (entry > top[0]):
+            heapq.heapreplace(top, entry)
+    top.sort(reverse=True)
+    return top,evaluated
@@ -5,15 +5,18 @@
 # @version 0.1
 # @date 2009-10-25
 
+import sys
 import InvertedIndex
 import FileParser
 from operator import itemgetter
 
 def main():
-    search()
+    if len(sys.argv) < 2:
+        print "usage: %s FOLDER [KEYWORD ...]" % (sys.argv[0])
+        sys.exit(1)
+    search(sys.argv[1], sys.argv[2:] or ['affeaffe', 'rfc'])
 
-def search():
-    maindir = "/Users/mrtazz/Documents/Computer Science/rfc_2000/"
+def search(maindir, searchwords):
     foo = InvertedIndex.IndexManager(maindir)
     foo.build_index()
 
@@ -40,7 +43,6 @@ def search():
                 #freq = f[1]
 
     print "Searching"
-    searchwords = ['affeaffe', 'rfc',]
     l =  foo.get_intersected_list(searchwords)
     print "Size of the index is %s." % (foo.get_index_size())
     print l
@@ -0,0 +1,380 @@
+"""
+@file Segment.py
+@brief binary on disk format for the inverted index
+@version 0.1
+
+a segment file consists of a fixed header followed by the sections
+listed in it. all numbers are stored little endian.
+
+    header            magic, version, counts and section offsets
+    term offsets      array('I') of term_count+1 offsets into the term blob
+    term blob         all terms sorted and concatenated
+    posting starts    array('I') of term_count+1 indexes into the columns
+    docids            array('i') of all document ids, term by term
+    tfs               array('i') of all term frequencies
+    scores            array('d') of all tf.idf scores
+    filename ids      array('i') of the document ids with a filename
+    filename offsets  array('I') of filename_count+1 offsets into the blob
+    filename blob     all filenames concatenated
+    mtimes            array('d') of the modification time of every file
+    sizes             array('d') of the size of every file
+    digests           16 byte md5 digest of every file
+    position offsets  array('I') of posting_count+1 offsets into the blob
+    position blob     the variable byte encoded word positions
+
+the posting lists of a term are the slices [start, end) of the docids,
+tfs, scores and position offsets columns. the manifest sections hold
+what is needed for incremental updates, in the order of the filename
+ids.
+"""
+
+import os
+import sys
+import mmap
+import shutil
+import struct
+import tempfile
+import itertools
+from array import array
+import Postings
+import Terms
+
+MAGIC = "ADMIRALS"
+VERSION = 3
+HEADER = struct.Struct("<8sIIQII15Q")
+# term length, posting count and position length of a term in a run
+RUN_ENTRY = struct.Struct("<III")
+
+def _to_disk(arr, f):
+    """ write an array in little endian byte order """
+    if (sys.byteorder == "big"):
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    arr.tofile(f)
+
+def _from_buffer(typecode, data):
+    """ read an array from little endian bytes """
+    arr = array(typecode)
+    arr.fromstring(data)
+    if (sys.byteorder == "big"): arr.byteswap()
+    return arr
+
+def write_segment(filepath, terms, postings, filenames, manifest, doc_count):
+    """ function to write an index to a segment file
+
+        Parameters:
+            filepath  -- the file to write the segment to
+            terms     -- sorted sequence of the terms
+            postings  -- sequence of the posting lists of the terms
+            filenames -- list of the filenames indexed by docid
+            manifest  -- hash map of the form
+                         { filename : (docid, mtime, size, md5 digest) }
+            doc_count -- number of documents the index was built from
+    """
+    writer = SegmentWriter(filepath)
+    try:
+        for t,p in itertools.izip(terms, postings):
+            writer.add(t, p)
+        writer.close(filenames, manifest, doc_count)
+    finally:
+        writer.remove()
+
+class SegmentWriter(object):
+    """ Class for writing a segment file term by term
+
+        the sections filled by the posting lists are collected in
+        temporary files next to the segment and copied behind the
+        header when the writer is closed, so only the posting list
+        being added is held in memory. the terms have to be added
+        in sorted order
+    """
+    def __init__(self, filepath):
+        """ Constructor which creates the temporary files
+
+            Parameters:
+                filepath -- the file to write the segment to
+        """
+        self.filepath = filepath
+        folder = os.path.dirname(os.path.abspath(filepath))
+        # term offsets, term blob, posting starts, docids, tfs,
+        # scores, position offsets and position blob
+        self.columns = []
+        for i in range(8):
+            fd,path = tempfile.mkstemp(prefix=".segment-", dir=folder)
+            self.columns.append((path, os.fdopen(fd, 'w+b')))
+        self.term_count = 0
+        self.term_size = 0
+        self.posting_count = 0
+        self.position_size = 0
+        _to_disk(array('I', [0]), self.columns[0][1])
+        _to_disk(array('I', [0]), self.columns[2][1])
+
+    def add(self, term, postings):
+        """ method to append a term with its posting list
+
+            Parameters:
+                term     -- the term, greater than all terms added before
+                postings -- the posting list of the term, with scores
+        """
+        files = [f for path,f in self.columns]
+        self.term_count += 1
+        self.term_size += len(term)
+        self.posting_count += len(postings)
+        _to_disk(array('I', [self.term_size]), files[0])
+        files[1].write(term)
+        _to_disk(array('I', [self.posting_count]), files[2])
+        _to_disk(postings.docids, files[3])
+        _to_disk(postings.tfs, files[4])
+        _to_disk(postings.scores, files[5])
+        _to_disk(array('I', [self.position_size + o for o in postings.position_offsets]),
+                 files[6])
+        files[7].write(postings.positions)
+        self.position_size += len(postings.positions)
+
+    def close(self, filenames, manifest, doc_count):
+        """ method to write the segment file from the added terms and
+            the table of the documents
+
+            Parameters:
+                filenames -- list of the filenames indexed by docid
+                manifest  -- hash map of the form
+                             { filename : (docid, mtime, size, md5 digest) }
+                doc_count -- number of documents the index was built from
+        """
+        files = [f for path,f in self.columns]
+        _to_disk(array('I', [self.position_size]), files[6])
+        docs = [d for d in xrange(len(filenames)) if filenames[d] is not None]
+        filename_ids = array('i', docs)
+        filename_offsets = array('I', [0])
+        mtimes = array('d')
+        filesizes = array('d')
+        digests = []
+        for d in docs:
+            filename_offsets.append(filename_offsets[-1] + len(filenames[d]))
+            entry = manifest.get(filenames[d], (d, 0, 0, "\0" * 16))
+            mtimes.append(entry[1])
+            filesizes.append(entry[2])
+            digests.append(entry[3])
+
+        # compute the position of every section
+        sizes = [f.tell() for f in files[:6]] + [
+                  4 * len(filename_ids), 4 * len(filename_offsets),
+                  filename_offsets[-1], 8 * len(docs), 8 * len(docs),
+                  16 * len(docs) ] + [f.tell() for f in files[6:]]
+        offsets = [HEADER.size]
+        for size in sizes:
+            offsets.append(offsets[-1] + size)
+
+        f = open(self.filepath, 'wb')
+        try:
+            f.write(HEADER.pack(MAGIC, VERSION, self.term_count, self.posting_count,
+                                doc_count, len(docs), *offsets))
+            for column in files[:6]:
+                column.seek(0)
+                shutil.copyfileobj(column, f)
+            _to_disk(filename_ids, f)
+            _to_disk(filename_offsets, f)
+            for d in docs:
+                f.write(filenames[d])
+            _to_disk(mtimes, f)
+            _to_disk(filesizes, f)
+            f.write("".join(digests))
+            for column in files[6:]:
+                column.seek(0)
+                shutil.copyfileobj(column, f)
+        finally:
+            f.close()
+
+    def remove(self):
+        """ method to delete the temporary files """
+        for path,f in self.columns:
+            f.close()
+            os.remove(path)
+        self.columns = []
+
+def write_run(filepath, index):
+    """ function to write the postings collected while building an
+        index to a run file, sorted by term. the runs of a build are
+        merged into a segment afterwards
+
+        every term is stored as a header of its length, the number of
+        postings and the length of the positions, followed by the
+        term, the document ids, term frequencies, position offsets
+        and the positions
+
+        Parameters:
+            filepath -- the file to write the run to
+            index    -- hash map of the form { key : postings }
+    """
+    write_run_entries(filepath, ((key, index[key]) for key in sorted(index)))
+
+def write_run_entries(filepath, entries):
+    """ function to write postings to a run file in the order they
+        are given, to write the runs merged from other runs
+
+        Parameters:
+            filepath -- the file to write the run to
+            entries  -- iterable of (term, postings) tuples in the
+                        order of the terms
+    """
+    f = open(filepath, 'wb')
+    try:
+        for key,postings in entries:
+            f.write(RUN_ENTRY.pack(len(key), len(postings), len(postings.positions)))
+            f.write(key)
+            _to_disk(postings.docids, f)
+            _to_disk(postings.tfs, f)
+            _to_disk(postings.position_offsets, f)
+            f.write(postings.positions)
+    finally:
+        f.close()
+
+def read_run(filepath):
+    """ function to read the terms of a run file one by one
+
+        Parameters:
+            filepath -- the run file to read
+
+        Returns:
+            generator of (term, Postings.PostingList) tuples in
+            the order of the terms
+    """
+    f = open(filepath, 'rb')
+    try:
+        while True:
+            entry = f.read(RUN_ENTRY.size)
+            if not entry: break
+            length,count,size = RUN_ENTRY.unpack(entry)
+            key = f.read(length)
+            postings = Postings.PostingList()
+            postings.docids = _from_buffer('i', f.read(4 * count))
+            postings.tfs = _from_buffer('i', f.read(4 * count))
+            postings.position_offsets = _from_buffer('I', f.read(4 * count))
+            postings.positions = bytearray(f.read(size))
+            yield key,postings
+    finally:
+        f.close()
+
+class SegmentReader(object):
+    """ Class for reading a segment file through mmap
+
+        the file is only mapped when it is opened, posting lists are
+        decoded lazily when a term is looked up. the reader can be
+        used like the list of posting lists of the IndexManager, the
+        term dictionary is read straight from the mapped file
+
+        postings = [ postings, ... ]
+    """
+    def __init__(self, filepath):
+        """ Constructor which maps the file and reads the header
+
+            Parameters:
+                filepath -- the segment file to open
+        """
+        f = open(filepath, 'rb')
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        if (len(self.map) < HEADER.size):
+            raise ValueError("%s is not an index segment" % filepath)
+        header = HEADER.unpack(self.map[:HEADER.size])
+        if (header[0] != MAGIC):
+            raise ValueError("%s is not an index segment" % filepath)
+        if (header[1] != VERSION):
+            raise ValueError("unsupported index segment version %s" % header[1])
+        (self.term_count, self.posting_count, self.doc_count,
+         self.filename_count) = header[2:6]
+        self.sections = header[6:]
+        self.terms = Terms.TermDictionary(self.map, self._read_array('I', 0),
+                                          self.sections[1])
+        self.posting_starts = self._read_array('I', 2)
+        self.filenames = self._read_filenames()
+        self.manifest = self._read_manifest()
+
+    def _read_array(self, typecode, section):
+        """ method to decode a complete section into an array """
+        return _from_buffer(typecode,
+                            self.map[self.sections[section]:self.sections[section+1]])
+
+    def _read_filenames(self):
+        """ method to decode the filename table
+
+            Returns:
+                list of the filenames indexed by docid
+        """
+        ids = self._read_array('i', 6)
+        offsets = self._read_array('I', 7)
+        blob = self.sections[8]
+        filenames = [None] * (max(ids or [0]) + 1)
+        for i in range(len(ids)):
+            filenames[ids[i]] = self.map[blob+offsets[i]:blob+offsets[i+1]]
+        return filenames
+
+    def _read_manifest(self):
+        """ method to decode the manifest of the indexed files
+
+            Returns:
+                hash map of the form
+                { filename : (docid, mtime, size, md5 digest) }
+        """
+        ids = self._read_array('i', 6)
+        mtimes = self._read_array('d', 9)
+        sizes = self._read_array('d', 10)
+        digests = self.sections[11]
+        manifest = {}
+        for i in range(len(ids)):
+            manifest[self.filenames[ids[i]]] = (ids[i], mtimes[i], int(sizes[i]),
+                                                self.map[digests+16*i:digests+16*(i+1)])
+        return manifest
+
+    def get_document_frequencies(self):
+        """ method to get the document frequencies of all terms
+            without decoding the posting lists
+
+            Returns:
+                array of the document frequencies in term order
+        """
+        starts = self.posting_starts
+        return array('i', [starts[i+1] - starts[i] for i in xrange(self.term_count)])
+
+    def get_postings(self, i):
+        """ method to decode the posting list of the term at a position
+
+            Parameters:
+                i -- position of the term in the dictionary
+
+            Returns:
+                Postings.PostingList of the term
+        """
+        start, end = self.posting_starts[i], self.posting_starts[i+1]
+        postings = Postings.PostingList()
+        postings.docids = _from_buffer('i', self.map[self.sections[3]+4*start:
+                                                     self.sections[3]+4*end])
+        postings.tfs = _from_buffer('i', self.map[self.sections[4]+4*start:
+                                                  self.sections[4]+4*end])
+        postings.scores = _from_buffer('d', self.map[self.sections[5]+8*start:
+                                                     self.sections[5]+8*end])
+        offsets = _from_buffer('I', self.map[self.sections[12]+4*start:
+                                             self.sections[12]+4*(end+1)])
+        first = offsets[0]
+        postings.position_offsets = array('I', [o - first for o in offsets[:-1]])
+        postings.positions = bytearray(self.map[self.sections[13]+first:
+                                                self.sections[13]+offsets[-1]])
+        return postings
+
+    def __getitem__(self, i):
+        if (i < 0): i += self.term_count
+        if (i < 0 or i >= self.term_count): raise IndexError(i)
+        return self.get_postings(i)
+
+    def __len__(self):
+        return self.term_count
+
+    def __iter__(self):
+        for i in xrange(self.term_count):
+            yield self.get_postings(i)
+
+    def close(self):
+        """ method to unmap the segment file """
+        self.map.close()
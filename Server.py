@@ -4,27 +4,147 @@ Author: Daniel Schauenberg <schauend@informatik.uni-freiburg.de>
 Description: class for implementing a search engine web server
 """
 import socket
+import select
+import threading
+import Queue
 import time
 import re
 import sys
 import os
 import InvertedIndex
+import Shards
+import Cache
+import StaticFiles
+import Metrics
 from operator import itemgetter
 
+class RequestTooLarge(Exception):
+    """ raised when the header or the body of a request is larger
+        than the server accepts
+    """
+
+class ChunkedResponse:
+    """ class for a response whose body is generated while it is sent.
+        the parts of the body are collected into chunks of at least
+        chunk_size bytes, which are sent with the chunked transfer
+        encoding of HTTP/1.1 as soon as they are full. an empty part
+        sends the parts collected so far right away
+    """
+    def __init__(self, header, parts, ctype="html", chunk_size=16384):
+        """ constructor method
+
+            Parameters:
+                header     -- the HTTP header of the response, announcing
+                              the chunked transfer encoding
+                parts      -- iterable of the strings making up the body,
+                              an empty string flushes the current chunk
+                ctype      -- the content type of the body
+                chunk_size -- minimum number of bytes sent per chunk
+        """
+        self.header = header
+        self.parts = parts
+        self.ctype = ctype
+        self.chunk_size = chunk_size
+        self.chunked = True
+        # number of body bytes sent so far
+        self.size = 0
+        # the body is kept up to this size, for caching it afterwards
+        self.keep = 0
+        self.body = None
+        self.listeners = []
+
+    def disable_chunking(self):
+        """ method to send the body as it is, for clients which don't
+            understand the chunked transfer encoding. the end of the
+            body is marked by closing the connection then
+        """
+        self.chunked = False
+        self.header = self.header.replace("Transfer-Encoding: chunked\n", "")
+
+    def add_listener(self, listener):
+        """ method to register a function called after the response
+            was sent, with the response and whether it was complete
+
+            Parameters:
+                listener -- function(response, complete)
+        """
+        self.listeners.append(listener)
+
+    def send(self, connection):
+        """ method to send the response, the body is generated chunk
+            by chunk so that only one chunk is held at a time
+
+            Parameters:
+                connection -- the socket of the client
+        """
+        complete = False
+        kept = []
+        try:
+            connection.sendall(self.header)
+            chunk = []
+            length = 0
+            for part in self.parts:
+                chunk.append(part)
+                length += len(part)
+                if (length >= self.chunk_size or (not part and length)):
+                    self.send_chunk(connection, "".join(chunk), kept)
+                    chunk = []
+                    length = 0
+            if chunk: self.send_chunk(connection, "".join(chunk), kept)
+            if self.chunked: connection.sendall("0\r\n\r\n")
+            complete = True
+        finally:
+            if (complete and self.size <= self.keep): self.body = "".join(kept)
+            for listener in self.listeners:
+                listener(self, complete)
+
+    def send_chunk(self, connection, data, kept):
+        """ method to send a part of the body
+
+            Parameters:
+                connection -- the socket of the client
+                data       -- the data to send
+                kept       -- list the body is kept in
+        """
+        if self.chunked:
+            connection.sendall("%x\r\n%s\r\n" % (len(data), data))
+        else:
+            connection.sendall(data)
+        self.size += len(data)
+        if (self.size <= self.keep): kept.append(data)
+        elif kept: del kept[:]
+
 class Webserver:
     """ class for implementing a web server, serving the
         inverted index search engine to the outside
         (or inside) world
     """
-    def __init__(self, host='', port=3366, docroot='.'):
+    def __init__(self, host='', port=3366, docroot='.', backlog=128,
+                 threads=8, timeout=15, cache_entries=1024,
+                 cache_bytes=16*1024*1024, reindex=False):
         """ constructor method to set the webserver basic settings
 
             Parameters:
-                host -- address to listen on, default is all
-                port -- port to listen on
+                host    -- address to listen on, default is all
+                port    -- port to listen on
+                backlog -- number of queued connections
+                threads -- number of threads answering requests, requests
+                           are answered one by one in the accepting
+                           thread if this is 1 or less
+                timeout -- seconds an idle keep-alive connection is kept
+                cache_entries -- maximum number of cached query results
+                cache_bytes   -- maximum total size of cached query results
+                reindex -- whether POST requests to /reindex update
+                           the index
         """
         self.host = host
         self.port = port
+        self.backlog = backlog
+        self.threads = threads
+        self.timeout = timeout
+        # maximum size of a request header and body
+        self.max_header = 65536
+        self.max_body = 1024*1024
         if (re.findall("/$",docroot)): self.docroot = docroot
         else: self.docroot = docroot +"/"
         self.pages = []
@@ -35,58 +155,408 @@ class Webserver:
                     self.pages.append(f)
         except:
             pass
+        # the pages are kept in memory and sent with precomputed headers
+        self.static_files = StaticFiles.StaticFiles(self.docroot, self.pages)
 
         self.socket = None
+        # connections handed back to the accepting thread after a
+        # request, and the socket pair waking it up for them
+        self.returned = Queue.Queue()
+        self.wakeup = None
+        self.running = False
         self.index_manager = None
+        # the index while it is built and the error if building failed
+        self.pending_index = None
+        self.build_error = None
+        # the thread updating the index for /reindex
+        self.reindexing = None
+        self.reindex_lock = threading.Lock()
         # actions which are executable by the webserver
         self.actions = {
                             "sentence"          : self.repeat_sentence,
                             "search"            : self.search_words,
+                            "batch"             : self.batch_search,
                             "prefix_search"     : self.prefix_search,
+                            "cache_stats"       : self.cache_stats,
+                            "metrics"           : self.show_metrics,
                             "default"           : self.http_404
                        }
+        # rescanning the folder is expensive, so it has to be enabled
+        if reindex: self.actions["reindex"] = self.reindex
+        # actions which need the index
+        self.index_actions = set(["search", "batch", "prefix_search", "reindex"])
+        # actions whose results only depend on the index
+        self.cached_actions = set(["search", "prefix_search"])
+        # actions which read the body of the request
+        self.body_actions = set(["batch", "reindex"])
+        self.cache = Cache.ResultCache(cache_entries, cache_bytes)
+        # request counters and latencies per action
+        self.metrics = Metrics.Metrics(time.time)
         self.re_params = re.compile("\w+=[a-zA-Z0-9+]+")
         self.re_action = re.compile("/\w+[a-zA-Z0-9.]*")
         # keyword to recognize that a sentence should be repeated
         self.sentence_keyword = "sentence"
+        # number of search results shown if no limit is given and
+        # the most which are shown at once
+        self.results_per_page = 50
+        self.max_results_per_page = 1000
+        # number of completions returned if no limit is given and the
+        # most which are returned at once
+        self.completions_per_page = 10
+        self.max_completions_per_page = InvertedIndex.MAX_COMPLETIONS
+        # most queries answered by one batch request
+        self.max_batch_queries = 1000
+        # streamed responses up to this size are kept for the cache
+        self.max_cached_stream = 1024*1024
 
-    def build_index(self,filepath):
+    def build_index(self,filepath,workers=1,compress=False,shards=1,
+                    budget=None,output=None,impacts=False):
         """ method to build the inverted index from which the
             searches will be done later on
 
             Parameters:
                 filepath -- the path to the folder to index
+                workers  -- number of processes to build the index with,
+                            not used with shards which build their parts
+                            at the same time
+                compress -- whether to keep the posting lists compressed
+                shards   -- number of processes to spread the index over,
+                            each of them answers its part of every query
+                budget   -- bytes of memory the build may use, the index
+                            is merged into a segment file then
+                output   -- the segment file to merge a budgeted build into
+                impacts  -- whether to keep the postings ordered by score
+                            as well, to answer ranked searches early
         """
-        # build inverted index object
-        self.index_manager = InvertedIndex.IndexManager(filepath)
-        self.index_manager.build_index()
+        if (shards > 1):
+            manager = Shards.ShardedIndex(filepath, shards, compress, impacts)
+        else:
+            # build inverted index object
+            manager = InvertedIndex.IndexManager(filepath, compress=compress,
+                                                 impacts=impacts)
+        # the index is only served once it is complete
+        self.pending_index = manager
+        if (shards > 1): manager.build_index()
+        elif budget: manager.build_index_external(budget, output)
+        else: manager.build_index(workers)
+        self.index_manager = manager
+        self.pending_index = None
+        return manager.get_index_size()
+
+    def build_index_background(self,filepath,workers=1,compress=False,shards=1,
+                               budget=None,output=None,done=None,impacts=False):
+        """ method to build the inverted index in a background thread,
+            so that the server can answer requests while it is built.
+            searches are answered with a warming up page until the
+            index is complete
+
+            Parameters:
+                filepath -- the path to the folder to index
+                workers  -- number of processes to build the index with
+                compress -- whether to keep the posting lists compressed
+                shards   -- number of processes to spread the index over
+                budget   -- bytes of memory the build may use
+                output   -- the segment file to merge a budgeted build into
+                done     -- function called with the number of words
+                            once the index is served
+                impacts  -- whether to keep the postings ordered by score
+
+            Returns:
+                the thread building the index
+        """
+        def build():
+            try:
+                size = self.build_index(filepath,workers,compress,shards,
+                                        budget,output,impacts)
+            except Exception, e:
+                self.build_error = "%s: %s" % (e.__class__.__name__, e)
+                print "Building the index failed: %s" % (self.build_error)
+                return
+            if done is not None: done(size)
+        thread = threading.Thread(target=build)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def load_index(self,indexpath,filepath=".",impacts=False):
+        """ method to load a prebuilt inverted index from a
+            segment file instead of indexing the documents
+
+            Parameters:
+                indexpath -- the segment file to load
+                filepath  -- the path to the folder the index was built from
+                impacts   -- whether to keep the postings ordered by score
+        """
+        self.index_manager = InvertedIndex.IndexManager(filepath, walk=False,
+                                                        impacts=impacts)
+        self.index_manager.load_segment(indexpath)
         return self.index_manager.get_index_size()
 
     def bind_to_port(self):
         """ simple method to make the port binding easier
         """
+        self.listen()
+        self.serve_connections()
+
+    def listen(self):
+        """ method to bind the listening socket to the port
+        """
         self.socket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind((self.host,self.port))
         # number of queued connections
-        self.socket.listen(3)
-        # create endless loop waiting for connections
+        self.socket.listen(self.backlog)
+        self.wakeup = socket.socketpair()
+        self.running = True
+
+    def stop(self):
+        """ method to make serve_connections return
+        """
+        self.running = False
+        self.wakeup[1].send("x")
+
+    def serve_connections(self):
+        """ method to accept connections and to wait for their requests.
+            the connections are only handed to the threads answering
+            requests once a request arrives, idle keep-alive connections
+            wait here and are closed after the timeout
+        """
+        connections = None
+        if (self.threads > 1):
+            # pool of threads answering requests of the connections
+            connections = Queue.Queue()
+            for i in range(self.threads):
+                worker = threading.Thread(target=self.handle_connections,
+                                          args=(connections,))
+                worker.daemon = True
+                worker.start()
+        listener = self.socket.fileno()
+        wakeup = self.wakeup[0].fileno()
+        # { fileno : (connection, address, deadline) }
+        idle = {}
+        # create endless loop waiting for connections and requests
         # can be interrupted via CTRL-C
         try:
-            while True:
-                # get socket object and client address
-                connection, clientsock = self.socket.accept()
-                print "Client %s connected." % (itemgetter(0)(clientsock))
-                data = connection.recv(4096)
-                if not data: break
-                # build proper response for request
-                response = self.parse_header(data)
-                connection.send(response)
-                connection.close()
-                print "Client %s disconnected." % (itemgetter(0)(clientsock))
+            while self.running:
+                now = time.time()
+                for fd,(connection,clientsock,deadline) in idle.items():
+                    if (deadline <= now):
+                        del idle[fd]
+                        self.close_connection(connection, clientsock)
+                sockets = [listener, wakeup] + idle.keys()
+                timeout = min([d for c,a,d in idle.values()] + [now + self.timeout]) - now
+                for fd in self.wait_readable(sockets, max(0, timeout)):
+                    if (fd == listener):
+                        # get socket object and client address
+                        connection, clientsock = self.socket.accept()
+                        print "Client %s connected." % (itemgetter(0)(clientsock))
+                        connection.settimeout(self.timeout)
+                        idle[connection.fileno()] = (connection, clientsock,
+                                                     time.time() + self.timeout)
+                    elif (fd == wakeup):
+                        self.wakeup[0].recv(4096)
+                        while True:
+                            try:
+                                connection, clientsock = self.returned.get_nowait()
+                            except Queue.Empty:
+                                break
+                            idle[connection.fileno()] = (connection, clientsock,
+                                                         time.time() + self.timeout)
+                    else:
+                        connection, clientsock, deadline = idle.pop(fd)
+                        if connections is None:
+                            self.answer_connection(connection, clientsock)
+                        else:
+                            connections.put((connection, clientsock))
         finally:
-            # don't leave socket open when going home
+            # don't leave sockets open when going home
+            for connection,clientsock,deadline in idle.values():
+                connection.close()
             self.socket.close()
 
+    def wait_readable(self,sockets,timeout):
+        """ method to wait until some of the sockets can be read
+
+            Parameters:
+                sockets -- list of the file numbers of the sockets
+                timeout -- seconds to wait at most
+
+            Returns:
+                list of the file numbers of the readable sockets
+        """
+        if not hasattr(select, "poll"):
+            return select.select(sockets, [], [], timeout)[0]
+        # poll has no limit on the number of connections
+        poller = select.poll()
+        for fd in sockets:
+            poller.register(fd, select.POLLIN)
+        return [fd for fd,event in poller.poll(timeout * 1000)]
+
+    def handle_connections(self,connections):
+        """ method run by the worker threads, answers the requests of
+            the connections from the queue until the server stops
+
+            Parameters:
+                connections -- queue of (connection, address) tuples
+        """
+        while True:
+            connection, clientsock = connections.get()
+            self.answer_connection(connection, clientsock)
+
+    def answer_connection(self,connection,clientsock):
+        """ method to answer the request which arrived on a connection.
+            requests sent ahead are answered as well, then the
+            connection is handed back to wait for the next request
+
+            Parameters:
+                connection -- the socket of the client
+                clientsock -- the address of the client
+        """
+        buf = self.answer_request(connection, clientsock, "")
+        while buf:
+            buf = self.answer_request(connection, clientsock, buf)
+        if buf is None:
+            self.close_connection(connection, clientsock)
+        else:
+            self.returned.put((connection, clientsock))
+            self.wakeup[1].send("x")
+
+    def close_connection(self,connection,clientsock):
+        """ method to close the connection to a client
+
+            Parameters:
+                connection -- the socket of the client
+                clientsock -- the address of the client
+        """
+        connection.close()
+        print "Client %s disconnected." % (itemgetter(0)(clientsock))
+
+    def handle_connection(self,connection,clientsock):
+        """ method to answer all requests coming in on a connection in
+            the calling thread. the connection is kept open for further
+            requests unless the client asks to close it
+
+            Parameters:
+                connection -- the socket of the client
+                clientsock -- the address of the client
+        """
+        print "Client %s connected." % (itemgetter(0)(clientsock))
+        connection.settimeout(self.timeout)
+        buf = ""
+        try:
+            while buf is not None:
+                buf = self.answer_request(connection, clientsock, buf)
+        finally:
+            self.close_connection(connection, clientsock)
+
+    def answer_request(self,connection,clientsock,buf):
+        """ method to read and answer one request of a connection
+
+            Parameters:
+                connection -- the socket of the client
+                clientsock -- the address of the client
+                buf        -- data already read from the connection
+
+            Returns:
+                data read beyond the request, None if the connection
+                has to be closed
+        """
+        try:
+            request,buf = self.read_request(connection,buf)
+            if request is None: return None
+            # build proper response for request
+            response = self.parse_header(request)
+            self.send_response(connection,response)
+            if self.keep_alive(request): return buf
+        except RequestTooLarge, e:
+            # the rest of the request is not read, so the connection
+            # can not be used any further
+            text = "%s\n" % (e)
+            try:
+                self.send_response(connection, self.get_header(code = 413, length = len(text),
+                                                               ctype="plain",
+                                                               extra="Connection: close\n") + text)
+            except socket.error:
+                pass
+        except socket.error:
+            pass
+        except Exception, e:
+            print "Error handling request from %s: %s" % (itemgetter(0)(clientsock), e)
+        return None
+
+    def read_request(self,connection,buf):
+        """ method to read one complete request from a connection
+
+            Parameters:
+                connection -- the socket of the client
+                buf        -- data already read from the connection
+
+            Returns:
+                the request or None if the connection was closed
+                data read beyond the request
+
+            Raises:
+                RequestTooLarge if the header or the body is too large
+        """
+        while True:
+            end = buf.find("\r\n\r\n")
+            if (end != -1):
+                end += 4
+                break
+            end = buf.find("\n\n")
+            if (end != -1):
+                end += 2
+                break
+            if (len(buf) > self.max_header):
+                raise RequestTooLarge("The request header is larger than %s bytes." % (
+                                      self.max_header))
+            data = connection.recv(4096)
+            if not data: return None,""
+            buf += data
+        if (end > self.max_header):
+            raise RequestTooLarge("The request header is larger than %s bytes." % (
+                                  self.max_header))
+        # read the body of the request, if there is one
+        length = re.findall("(?im)^content-length:\s*(\d+)", buf[:end])
+        if length:
+            if (int(length[0]) > self.max_body):
+                raise RequestTooLarge("The request body is larger than %s bytes." % (
+                                      self.max_body))
+            end += int(length[0])
+            while (len(buf) < end):
+                data = connection.recv(max(4096, end - len(buf)))
+                if not data: return None,""
+                buf += data
+        return buf[:end],buf[end:]
+
+    def send_response(self,connection,response):
+        """ method to send a response to the client
+
+            Parameters:
+                connection -- the socket of the client
+                response   -- the response, either a string or an
+                              object with a send(connection) method
+        """
+        if isinstance(response, basestring):
+            connection.sendall(response)
+        else:
+            response.send(connection)
+
+    def keep_alive(self,request):
+        """ method to find out if the connection should be kept open
+            after answering the request. only HTTP/1.1 connections are
+            kept, as long as the client doesn't ask to close them
+
+            Parameters:
+                request -- the complete request
+
+            Returns:
+                True if the connection should be kept open
+        """
+        head = request.split("\n\n")[0].split("\r\n\r\n")[0]
+        if not re.findall("^\S+ \S+ HTTP/1.1", head): return False
+        return not re.findall("(?im)^connection:\s*close", head)
+
     def parse_header(self,data):
         """ method to parse the HTTP header for specific actions
 
@@ -96,6 +566,7 @@ class Webserver:
             Return:
                 the proper response to the request
         """
+        request = data
         # get the first line of the header
         data = data.split("\n")[0]
         # HEAD request gets special treatment (returns immediately)
@@ -115,28 +586,164 @@ class Webserver:
         matches = re.findall(self.re_params,data)
         for m in matches:
             params[m.split("=")[0]] = m.split("=")[1]
+        # files are counted together, so that arbitrary file
+        # names don't create new metrics
+        label = action
+        if action not in self.actions: label = "static"
+        start = time.time()
+        self.metrics.start_request()
+        def observe(response, complete=True):
+            self.metrics.observe(label, time.time() - start,
+                                 self.get_response_size(response),
+                                 self.get_status(response) >= 400 or not complete)
+        try:
+            response = self.dispatch(action,params,request)
+        except:
+            observe(None)
+            raise
+        if isinstance(response, ChunkedResponse):
+            # only HTTP/1.1 clients understand chunked bodies
+            if not re.findall("^\S+ \S+ HTTP/1.1", data): response.disable_chunking()
+            # the body is generated while it is sent, so the request
+            # is only done afterwards
+            response.add_listener(observe)
+        else:
+            observe(response)
+        return response
+
+    def dispatch(self,action,params,request):
+        """ method to call the method answering the requested action
+
+            Parameters:
+                action  -- the requested action
+                params  -- the URL GET parameters
+                request -- the complete request
+
+            Returns:
+                the response to the request
+        """
         # call the appropriate method from the actions hashmap
-        return self.actions.get(action,self.get_page_from_fs)(action,params)
+        handler = self.actions.get(action)
+        if handler is None:
+            return self.get_page_from_fs(action,params,request)
+        if (action in self.index_actions and self.index_manager is None):
+            return self.warming_up(action,params)
+        if (action in self.cached_actions and self.index_manager is not None):
+            return self.get_cached_response(handler,action,params)
+        if action in self.body_actions:
+            return handler(action,params,request)
+        return handler(action,params)
+
+    def get_status(self,response):
+        """ method to get the HTTP status code of a response
+
+            Parameters:
+                response -- the response, None if it failed
+
+            Returns:
+                the status code, 500 for failed responses
+        """
+        if response is None: return 500
+        if not isinstance(response, basestring): response = response.header
+        try:
+            return int(response.split(" ", 2)[1])
+        except (IndexError, ValueError):
+            return 500
+
+    def get_response_size(self,response):
+        """ method to get the number of bytes of a response
+
+            Parameters:
+                response -- the response, None if it failed
+        """
+        if response is None: return 0
+        if isinstance(response, basestring): return len(response)
+        return len(response.header) + response.size
+
+    def show_metrics(self,pagename,params):
+        """ method to show the request metrics and the counters of
+            the cache and the index, in the prometheus text format
+
+            Returns:
+                plain text page with the metrics
+        """
+        gauges = {}
+        for k,v in self.cache.get_stats().items():
+            gauges["admiral_cache_%s" % k] = v
+        if self.index_manager is not None:
+            gauges["admiral_index_terms"] = self.index_manager.get_index_size()
+            gauges["admiral_index_documents"] = self.index_manager.doc_count
+            gauges["admiral_index_generation"] = self.index_manager.generation
+        gauges["admiral_index_ready"] = int(self.index_manager is not None)
+        text = self.metrics.render(gauges)
+        return self.get_header(code = 200, length = len(text),
+                               ctype="plain; version=0.0.4") + text
+
+    def get_cached_response(self,handler,action,params):
+        """ method to answer a request from the result cache, the
+            response is computed and cached on a miss. cached results
+            are dropped when the index changes
 
-    def get_page_from_fs(self, pagename, params):
+            Parameters:
+                handler -- the method computing the response
+                action  -- the requested action
+                params  -- the URL GET parameters
+
+            Returns:
+                the response to the request
+        """
+        key = (action, tuple(sorted(params.items())))
+        generation = self.index_manager.generation
+        response = self.cache.get(key, generation)
+        if response is None:
+            response = handler(action,params)
+            if isinstance(response, ChunkedResponse):
+                # the body is only known after it was sent
+                def put(response, complete):
+                    if response.body is None: return
+                    header = self.get_header(code = 200, length = len(response.body),
+                                             ctype = response.ctype)
+                    self.cache.put(key, header + response.body, generation)
+                response.keep = self.max_cached_stream
+                response.add_listener(put)
+            else:
+                self.cache.put(key, response, generation)
+        return response
+
+    def cache_stats(self,pagename,params):
+        """ method to show the counters of the result cache
+
+            Returns:
+                plain text page with one counter per line
+        """
+        stats = self.cache.get_stats()
+        text = "".join(["%s %s\n" % (k, stats[k]) for k in sorted(stats)])
+        return self.get_header(code = 200, length = len(text), ctype="plain") + text
+
+    def get_page_from_fs(self, pagename, params, request=""):
         """method for getting files from filesystem
 
             Parameters:
                 pagename -- name of the requested page
+                request  -- the complete request, to answer
+                            conditional requests
 
             Returns:
-                html page or 404 page
+                html page, 304 not modified or 404 page
         """
-        if pagename in self.pages:
-            page = open(self.docroot + pagename).read()
-            ctypes = pagename.split(".")
-            if len(ctypes) > 1:
-                ctype = ctypes[len(ctypes)-1]
-            else:
-                ctype = "html"
-            return self.get_header(code = 200, length = len(page), ctype=ctype) + page
-        else:
+        page = self.static_files.get(pagename)
+        if page is None:
             return self.http_404()
+        # the client still has the current version
+        etags = re.findall("(?im)^if-none-match:\s*(.*?)\s*$", request)
+        if etags and (etags[0] == "*" or page.etag in
+                      [e.strip() for e in etags[0].split(",")]):
+            return self.get_header(code = 304, ctype=page.ctype, extra=page.headers)
+        header = self.get_header(code = 200, length = page.size, ctype=page.ctype,
+                                 extra=page.headers)
+        if page.body is None:
+            return StaticFiles.FileResponse(header, page.path, page.size)
+        return header + page.body
 
     def repeat_sentence(self,pagename,params):
         """ method to repeat a specific sentence a provided
@@ -186,32 +793,172 @@ class Webserver:
         # append the first item again
         keywords.append(first_word)
 
+        # page of the results to show
+        limit = self.get_int_param(params, "limit", self.results_per_page,
+                                   1, self.max_results_per_page)
+        offset = self.get_int_param(params, "offset", 0)
+        # the keywords have to appear next to each other in their order
+        phrase = bool(params.get("phrase"))
+
+        # the page is sent while it is put together, the search runs
+        # after the head of the page went out
+        parts = self.get_search_page(keywords_text, phrase, keywords, limit, offset)
+        return self.get_chunked_response(parts)
+
+    def get_search_page(self,keywords_text,phrase,keywords,limit,offset):
+        """ method to generate the html page with the search results
+            piece by piece. the head of the page is flushed before the
+            index is searched, the results are formatted one by one
+
+            Parameters:
+                keywords_text -- the keywords separated by spaces
+                phrase        -- whether the keywords were a phrase
+                keywords      -- list of the keywords
+                limit         -- number of results per page
+                offset        -- number of results on the previous pages
+
+            Returns:
+                generator of the parts of the page
+        """
         # basic page definitions
         title = "Search Results"
-        body = '<h2>Inverted Index Search:</h2> \
+        head,tail = self.get_html_frame(title)
+        yield head
+        yield '<h2>Inverted Index Search:</h2> \
                 <form name="input" action="/search" method="get">\
                 Insert words to search for: </br>\
                 <input type="text" name="keywords" value="%s" />\
+                <input type="checkbox" name="phrase" value="1"%s /> phrase\
                 <input type="submit" value="Submit" />\
-                </form> <h1> Search results: </h1>' % (keywords_text)
+                </form> <h1> Search results: </h1>' % (keywords_text,
+                                                       phrase and ' checked="checked"' or '')
+        # send the head before the search
+        yield ""
 
-        # get the list intersection for the keywords
-        result = self.index_manager.get_andish_retrieval(keywords)
+        # get the best scored documents for the keywords, the index is
+        # released before the results are sent
+        with self.metrics.lookup():
+            if phrase:
+                result = self.index_manager.get_phrase_retrieval(keywords_text.split(" "),
+                                                                 limit,offset)
+            else:
+                result = self.index_manager.get_andish_retrieval(keywords,limit,offset)
 
         # check if there were any results
         if (result == -1):
             # result -1 means one of the keywords wasn't in the index
-            body += '<h3> The keyword combination \"%s\" was not found in\
+            yield '<h3> The keyword combination \"%s\" was not found in\
                     any document.</h3>' % (keywords_text)
         else:
             # put together documents containing the keywords
-            body +=  '<h3> Search result for keywords \"%s\": </h3>' % (keywords_text)
+            yield '<h3> Search result for keywords \"%s\": </h3>' % (keywords_text)
             # add all the results to the page
+            count = 0
             for r in result:
-                body += "%s   ||  Score: %s.</br>" %(r[0],r[1])
+                count += 1
+                yield "%s   ||  Score: %s.</br>" %(r[0],r[1])
+            # links to the neighbouring pages
+            query = "/search?keywords=%s&limit=%s" % (keywords_text.replace(" ","+"), limit)
+            if phrase: query += "&phrase=1"
+            if (offset > 0):
+                yield '<a href="%s&offset=%s">previous</a> ' % (query, max(0, offset - limit))
+            if (count == limit):
+                yield '<a href="%s&offset=%s">next</a>' % (query, offset + limit)
+        yield tail
 
-        html = self.get_html_page(title,body)
-        return self.get_header(code = 200,length = len(html)) + html
+    def batch_search(self,pagename,params,request=""):
+        """ method to answer many keyword queries at once. the queries
+            are sent as body of a POST request, one query per line with
+            the keywords separated by spaces or plus signs
+
+            Parameters:
+                params  -- the URL GET parameters
+                request -- the complete request
+
+            Returns:
+                plain text page with one line per query in the order of
+                the queries, holding the filenames and scores of the
+                results separated by tabs, 413 if there are too many
+                queries
+        """
+        body = re.split("\r?\n\r?\n", request, 1)
+        queries = []
+        if (len(body) > 1):
+            queries = [line.replace("+", " ").split() for line in body[1].splitlines()]
+        if (len(queries) > self.max_batch_queries):
+            text = "A batch holds at most %s queries.\n" % (self.max_batch_queries)
+            return self.get_header(code = 413, length = len(text), ctype="plain") + text
+        limit = self.get_int_param(params, "limit", self.results_per_page,
+                                   1, self.max_results_per_page)
+        with self.metrics.lookup():
+            results = self.index_manager.get_batch_retrieval(queries, limit)
+        lines = []
+        for result in results:
+            lines.append("\t".join(["%s\t%r" % r for r in result]))
+        text = "".join([line + "\n" for line in lines])
+        return self.get_header(code = 200, length = len(text), ctype="plain") + text
+
+    def get_int_param(self,params,name,default,minimum=0,maximum=None):
+        """ method to get an integer GET parameter within bounds
+
+            Parameters:
+                params  -- the URL GET parameters
+                name    -- name of the parameter
+                default -- value if the parameter is missing or invalid
+                minimum -- smallest value of the parameter
+                maximum -- largest value of the parameter, None if the
+                           parameter is not bounded
+
+            Returns:
+                the value of the parameter
+        """
+        try:
+            value = max(minimum, int(params[name]))
+        except (KeyError, ValueError):
+            return default
+        if maximum is not None: value = min(maximum, value)
+        return value
+
+    def reindex(self,pagename,params,request=""):
+        """ method to start updating the index with the files which
+            were added, changed or removed in the indexed folder. the
+            update runs in a background thread, searches are answered
+            from the old index until it is complete. only POST requests
+            start an update and only one runs at a time
+
+            Parameters:
+                params  -- the URL GET parameters
+                request -- the complete request
+
+            Returns:
+                plain text 202 page, or 405 if the request is no POST
+        """
+        if not re.findall("^POST ", request):
+            text = "The index is only updated by POST requests.\n"
+            return self.get_header(code = 405, length = len(text), ctype="plain",
+                                   extra="Allow: POST\n") + text
+        with self.reindex_lock:
+            running = self.reindexing is not None and self.reindexing.is_alive()
+            if not running:
+                self.reindexing = threading.Thread(target=self.update_index)
+                self.reindexing.daemon = True
+                self.reindexing.start()
+        if running: text = "The index is being updated already.\n"
+        else: text = "Updating the index.\n"
+        return self.get_header(code = 202, length = len(text), ctype="plain") + text
+
+    def update_index(self):
+        """ method to update the index, run by the thread started
+            by reindex
+        """
+        try:
+            with self.metrics.lookup():
+                added,changed,removed = self.index_manager.update_index()
+        except Exception, e:
+            print "Updating the index failed: %s: %s" % (e.__class__.__name__, e)
+            return
+        print "Index updated: %s added, %s changed, %s removed, %s words." % (
+              added, changed, removed, self.index_manager.get_index_size())
 
     def search_index_page(self,pagename,params):
         """ simple method to display a page with a search box
@@ -238,10 +985,11 @@ class Webserver:
             index
 
             Parameters:
-                prefix -- the prefix to search for
+                query -- the prefix to search for
+                limit -- maximum number of completions
 
             Returns:
-                list of matches in xml format
+                list of the most frequent matches in xml format
         """
         # get prefix
         try:
@@ -249,29 +997,57 @@ class Webserver:
         except KeyError:
             # just return if we have no query
             return self.get_header(code = 200, length = 0)
+        limit = self.get_int_param(params, "limit", self.completions_per_page,
+                                   1, self.max_completions_per_page)
+        return self.get_chunked_response(self.get_completion_xml(prefix, limit),
+                                         ctype="xml")
+
+    def get_completion_xml(self,prefix,limit):
+        """ method to generate the xml with the completions of a prefix
+            piece by piece, the completions are looked up after the
+            head of the xml was sent
+
+            Parameters:
+                prefix -- the prefix to search for
+                limit  -- maximum number of completions
+
+            Returns:
+                generator of the parts of the xml
+        """
         # build basic xml
-        xml = "<?xml version=\"1.0\" encoding=\"UTF-8\" ?>\n"
-        #xml += "<query>%s</query>\n" % prefix
-        xml += "<results>\n"
-        # get words matching the prefix
-        words = self.index_manager.prefix_search(prefix)
-        # get documents for the words
-        mergedlist = self.index_manager.k_way_merge(words)
-        # enter documents in xml
-        if mergedlist != -1:
-            all_docs = len(mergedlist)
-            for w in words:
-                docs = self.index_manager.get_documents(w)
-                perc = (float(len(docs)*100))/float(all_docs)
-                xml += "<item>"
-                xml += "<completion>%s</completion>\n" % w
-                xml += "<doclength>%s</doclength>\n" % (len(docs))
-                xml += "<percentage>%.3f</percentage>\n" % (perc)
-                xml += "</item>\n"
-
-        xml += "</results>"
-        # return xml
-        return self.get_header(code = 200, length = len(xml), ctype="xml") + unicode(xml,"UTF-8")
+        yield "<?xml version=\"1.0\" encoding=\"UTF-8\" ?>\n"
+        yield "<results>\n"
+        yield ""
+        # get the most frequent words matching the prefix
+        with self.metrics.lookup():
+            words = self.index_manager.get_completions(prefix, limit)
+        all_docs = max(1, self.index_manager.doc_count)
+        # enter words in xml
+        for w,df in words:
+            perc = (float(df*100))/float(all_docs)
+            yield "<item>"
+            yield "<completion>%s</completion>\n" % w
+            yield "<doclength>%s</doclength>\n" % (df)
+            yield "<percentage>%.3f</percentage>\n" % (perc)
+            yield "</item>\n"
+        yield "</results>"
+
+    def warming_up(self,pagename,params):
+        """ method to answer the actions needing the index while it
+            is still built
+
+            Returns:
+                plain text 503 page with the progress of the build
+        """
+        progress = getattr(self.pending_index, "progress", None)
+        if self.build_error is not None:
+            text = "Building the index failed: %s\n" % (self.build_error)
+        elif progress is None:
+            text = "Warming up, the index is built.\n"
+        else:
+            text = "Warming up, %.1f%% of the documents indexed.\n" % (progress * 100)
+        return self.get_header(code = 503, length = len(text), ctype="plain",
+                               extra="Retry-After: 1\n") + text
 
     def http_404(self,*args):
         """ basic HTTP 404 not found response
@@ -286,20 +1062,32 @@ class Webserver:
         html = self.get_html_page(title,body)
         return self.get_header(code = 404,length = len(html)) + html
 
-    def get_header(self, code=200, length="", ctype="html"):
+    def get_header(self, code=200, length="", ctype="html", extra=""):
         """ method to create the basic header for returning to
             the client
+
+            Parameters:
+                code   -- the HTTP status code
+                length -- length of the body, left out if empty
+                ctype  -- the content type of the body
+                extra  -- further header lines
         """
         # build header according to given code
         status = {
                      200 : "HTTP/1.1 200 OK\n",
-                     404 : "HTTP/1.1 404 Not Found\n"
+                     202 : "HTTP/1.1 202 Accepted\n",
+                     304 : "HTTP/1.1 304 Not Modified\n",
+                     404 : "HTTP/1.1 404 Not Found\n",
+                     405 : "HTTP/1.1 405 Method Not Allowed\n",
+                     413 : "HTTP/1.1 413 Request Entity Too Large\n",
+                     503 : "HTTP/1.1 503 Service Unavailable\n"
                  }
         content = "Content-Type: text/%s; charset=UTF-8\n" % (ctype)
         date = "Date: %s" % (time.strftime("%a, %d %b %Y %H:%M:%S %Z \n", time.localtime()))
         server = "Server: py-admiral 0.1 \n"
-        length = "Content-Length: %s \n" % (length)
-        return status[code] + content + date + server + length + "\n"
+        if (length != ""):
+            length = "Content-Length: %s \n" % (length)
+        return status[code] + content + date + server + length + extra + "\n"
 
     def get_html_page(self,title,content):
         """ method to return a basic html header with a title
@@ -311,7 +1099,35 @@ class Webserver:
             Returns:
                 a basic html page
         """
-        html =  "<html>\
+        head,tail = self.get_html_frame(title)
+        return head + content + tail
+
+    def get_html_frame(self,title):
+        """ method to get the parts of a basic html page surrounding
+            its content, for pages which are sent piece by piece
+
+            Parameters:
+                title   -- the html page title
+
+            Returns:
+                the html before and after the content
+        """
+        head =  "<html>\
                 <head><title>%s</title></head>\
-                <body>%s</body></html>" % (title,content)
-        return html
+                <body>" % (title)
+        return head,"</body></html>"
+
+    def get_chunked_response(self,parts,ctype="html"):
+        """ method to create a response whose body is sent in chunks
+            while it is generated
+
+            Parameters:
+                parts -- iterable of the strings making up the body
+                ctype -- the content type of the body
+
+            Returns:
+                ChunkedResponse sending the parts
+        """
+        header = self.get_header(code = 200, ctype = ctype,
+                                 extra = "Transfer-Encoding: chunked\n")
+        return ChunkedResponse(header, parts, ctype)
@@ -0,0 +1,363 @@
+"""
+@file Shards.py
+@brief inverted index partitioned over several worker processes
+@version 0.1
+"""
+
+import os
+import sys
+import heapq
+import Queue
+import threading
+import itertools
+import multiprocessing
+import InvertedIndex
+import Completion
+import Terms
+from array import array
+from operator import itemgetter
+
+# methods of the IndexManager a shard answers
+SHARD_METHODS = frozenset(["get_andish_retrieval", "get_phrase_retrieval",
+                           "get_batch_retrieval", "get_intersected_list",
+                           "get_word_frequencies",
+                           "get_document_count", "set_global_statistics",
+                           "update_index", "get_memory_usage"])
+
+def run_shard(connection, folder, number, count, compress, impacts=False):
+    """ function run by the process of a shard. the shard indexes
+        its part of the documents and then answers the calls sent
+        through the connection until it is closed. every answer
+        carries the id of its call
+
+        the shard builds its part in a single process, it is a
+        daemonic process and can not start a pool of its own. the
+        shards build their parts at the same time instead
+
+        Parameters:
+            connection -- the end of the pipe to the ShardedIndex
+            folder     -- the folder with the documents to index
+            number     -- the number of the shard
+            count      -- the number of shards
+            compress   -- whether to compress the posting lists
+            impacts    -- whether to keep impact ordered lists
+    """
+    # the progress output of all shards would be interleaved
+    sys.stdout = open(os.devnull, 'w')
+    manager = InvertedIndex.IndexManager(folder, compress=compress,
+                                         shard=(number, count), impacts=impacts)
+    manager.build_index()
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request is None: break
+        call,method,args = request
+        try:
+            if method not in SHARD_METHODS:
+                raise AttributeError("shards do not answer %s" % method)
+            result = (call, True, getattr(manager, method)(*args))
+        except Exception, e:
+            result = (call, False, "%s: %s" % (e.__class__.__name__, e))
+        connection.send(result)
+    connection.close()
+
+class ShardedIndex:
+    """ Class spreading the documents of a folder over several
+        processes, each holding an IndexManager for its part of the
+        documents. every query is sent to all shards at once and
+        their results are merged into the global ranking
+
+        the shards score with the document frequencies of the whole
+        collection, which are gathered after every change of the
+        index. the summed frequencies are kept here as well, in the
+        form of a term dictionary and an array of the document
+        frequencies indexed by term id, to complete prefixes
+        without asking the shards
+
+        the calls are tagged with an id, a thread per shard reads its
+        answers and hands them to the waiting call, so that calls of
+        several threads are sent to the shards while others still wait
+        for their answers. the lock of a shard is only held to send.
+        the shards build their parts at the same time, each in one
+        process, so they are not built with worker processes
+
+        shards = [ (process, connection, lock, reader), ... ]
+        waiting = { call id : queue of (shard number, ok, result) }
+    """
+    def __init__(self, folder, shards=2, compress=False, impacts=False):
+        """ Constructor
+
+            Parameters:
+                folder   -- the folder with the documents to index
+                shards   -- number of processes to spread the documents over
+                compress -- whether to compress the posting lists
+                impacts  -- whether the shards keep impact ordered lists
+        """
+        self.folder = folder
+        self.shard_count = max(1, shards)
+        self.compress = compress
+        self.impacts = impacts
+        self.shards = []
+        self.waiting = {}
+        self.calls = itertools.count()
+        self.terms = Terms.build_dictionary([])
+        self.dfs = array('i')
+        self.doc_count = 0
+        self.completions = None
+        self.generation = InvertedIndex.generations.next()
+
+    def build_index(self):
+        """ method to start the shards and to wait until all of them
+            have indexed their documents
+        """
+        for number in range(self.shard_count):
+            connection,child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_shard,
+                                              args=(child, self.folder, number,
+                                                    self.shard_count, self.compress,
+                                                    self.impacts))
+            process.daemon = True
+            process.start()
+            child.close()
+            reader = threading.Thread(target=self.read_answers,
+                                      args=(number, connection))
+            reader.daemon = True
+            reader.start()
+            self.shards.append((process, connection, threading.Lock(), reader))
+        self.update_statistics()
+
+    def read_answers(self, number, connection):
+        """ method run by the reader thread of a shard, handing the
+            answers of the shard to the calls waiting for them. when
+            the shard exits, the calls still waiting for it fail
+
+            Parameters:
+                number     -- the number of the shard
+                connection -- the end of the pipe to the shard
+        """
+        while True:
+            try:
+                call,ok,result = connection.recv()
+            except (EOFError, IOError):
+                break
+            queue = self.waiting.get(call)
+            if queue is not None: queue.put((number, ok, result))
+        for queue in self.waiting.values():
+            queue.put((number, False, "the shard exited"))
+
+    def call(self, method, *args):
+        """ method to call a method of the IndexManager of every shard.
+            the call is sent to all shards before the first answer is
+            read, so that the shards work on it at the same time
+
+            Parameters:
+                method -- name of the method
+                args   -- arguments of the method
+
+            Returns:
+                list of the results of all shards
+        """
+        call = self.calls.next()
+        queue = Queue.Queue()
+        self.waiting[call] = queue
+        try:
+            for process,connection,lock,reader in self.shards:
+                with lock:
+                    connection.send((call, method, args))
+            answers = [queue.get() for shard in self.shards]
+        finally:
+            del self.waiting[call]
+        results = [None] * len(answers)
+        for number,ok,result in sorted(answers):
+            if not ok: raise RuntimeError("shard %s failed: %s" % (number, result))
+            results[number] = result
+        return results
+
+    def update_statistics(self):
+        """ method to gather the document frequencies of all shards
+            and to make the shards score with the global ones
+        """
+        frequencies = {}
+        for words in self.call("get_word_frequencies"):
+            for key,df in words:
+                frequencies[key] = frequencies.get(key, 0) + df
+        doc_count = sum(self.call("get_document_count"))
+        self.call("set_global_statistics", doc_count, frequencies)
+        keys = frequencies.keys()
+        keys.sort()
+        dfs = array('i', [frequencies[k] for k in keys])
+        terms = Terms.build_dictionary(keys)
+        # the trie is built before it is served, not by the first search
+        self.completions = Completion.CompletionTrie(terms, dfs,
+                                                     InvertedIndex.MAX_COMPLETIONS)
+        self.dfs = dfs
+        self.terms = terms
+        self.doc_count = doc_count
+        self.generation = InvertedIndex.generations.next()
+
+    def merge_results(self, results, limit, offset):
+        """ method to merge the ranked results of the shards
+
+            Parameters:
+                results -- list of the (filename, score) lists of the shards
+                limit   -- maximum number of results, None for all
+                offset  -- number of best results to skip
+
+            Returns:
+                list of (filename, score) tuples ordered by score
+        """
+        results = itertools.chain(*results)
+        if limit is None:
+            return sorted(results, key=itemgetter(1), reverse=True)[offset:]
+        return heapq.nlargest(offset + limit, results, key=itemgetter(1))[offset:]
+
+    def get_andish_retrieval(self, keywords, limit=None, offset=0):
+        """ method to do and-ish retrieval with scores on all shards,
+            every shard only returns its best offset+limit results
+
+            Parameters:
+                keywords -- array of keywords
+                limit    -- maximum number of results to return, all
+                            results are returned if this is None
+                offset   -- number of best results to skip
+
+            Returns:
+                list of (filename, score) tuples, ordered by tf.idf score
+        """
+        top = None
+        if limit is not None: top = offset + limit
+        return self.merge_results(self.call("get_andish_retrieval", keywords, top),
+                                  limit, offset)
+
+    def get_phrase_retrieval(self, keywords, limit=None, offset=0):
+        """ method to search for a phrase on all shards
+
+            Parameters:
+                keywords -- array of the keywords of the phrase
+                limit    -- maximum number of results to return, all
+                            results are returned if this is None
+                offset   -- number of best results to skip
+
+            Returns:
+                list of (filename, score) tuples, ordered by tf.idf score
+        """
+        top = None
+        if limit is not None: top = offset + limit
+        return self.merge_results(self.call("get_phrase_retrieval", keywords, top),
+                                  limit, offset)
+
+    def get_batch_retrieval(self, queries, limit=None):
+        """ method to do and-ish retrieval for many queries at once,
+            the whole batch is sent to every shard in one call
+
+            Parameters:
+                queries -- list of arrays of keywords
+                limit   -- maximum number of results per query, all
+                           results are returned if this is None
+
+            Returns:
+                list of the results of the queries in their order, each
+                a list of (filename, score) tuples ordered by score
+        """
+        results = self.call("get_batch_retrieval", queries, limit)
+        return [self.merge_results(r, limit, 0) for r in zip(*results)]
+
+    def get_intersected_list(self, keywords):
+        """ method to get the documents of all shards containing all
+            keywords
+
+            Parameters:
+                keywords -- array of keywords to search for
+
+            Returns:
+                hash map of the form { filename : docid } where docid
+                is the id within the shard, -1 if one of the keywords
+                is not in the index
+        """
+        for key in keywords:
+            if (self.terms.find(key.lower()) == -1): return -1
+        returnlist = {}
+        for result in self.call("get_intersected_list", keywords):
+            # a shard without one of the keywords has no match
+            if (result != -1): returnlist.update(result)
+        return returnlist
+
+    def get_completions(self, prefix, limit=None):
+        """ method to get the most frequent terms of all shards
+            starting with a prefix
+
+            Parameters:
+                prefix -- the prefix to complete
+                limit  -- maximum number of completions, at most
+                          InvertedIndex.MAX_COMPLETIONS
+
+            Returns:
+                list of (term, document frequency) tuples
+        """
+        if self.completions is None: return []
+        return self.completions.complete(prefix.lower(), limit)
+
+    def get_document_frequencies(self):
+        """ method to get the document frequencies in all shards
+
+            Returns:
+                array of the document frequencies indexed by term id
+        """
+        return self.dfs
+
+    def get_word_frequencies(self):
+        """ method to get the words with their document frequency
+            in all shards
+
+            Returns:
+                list of (word, df) tuples, sorted by df
+        """
+        return sorted(itertools.izip(self.terms, self.dfs), key=itemgetter(1))
+
+    def update_index(self):
+        """ method to bring the shards up to date with the folder
+
+            Returns:
+                tuple of the number of (added, changed, removed) files
+        """
+        counts = self.call("update_index")
+        self.update_statistics()
+        return tuple([sum(c) for c in zip(*counts)])
+
+    def get_document_count(self):
+        """ method to get the number of documents in all shards """
+        return self.doc_count
+
+    def get_index_size(self):
+        """ method to get the number of distinct terms in all shards """
+        return len(self.terms)
+
+    def get_memory_usage(self):
+        """ method to get the memory used by the posting lists of
+            all shards
+
+            Returns:
+                tuple of (bytes, number of postings, bytes per posting)
+        """
+        size = 0
+        count = 0
+        for s,c,per_posting in self.call("get_memory_usage"):
+            size += s
+            count += c
+        if (count == 0): return size,0,0.0
+        return size,count,float(size)/count
+
+    def close(self):
+        """ method to stop the processes of the shards
+        """
+        for process,connection,lock,reader in self.shards:
+            with lock:
+                connection.send(None)
+        # the readers stop when the shards closed their connections
+        for process,connection,lock,reader in self.shards:
+            reader.join()
+            connection.close()
+            process.join()
+        self.shards = []
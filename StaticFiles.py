@@ -0,0 +1,142 @@
+"""
+File: StaticFiles.py
+Description: in memory cache for the static files of the webserver
+"""
+import os
+import hashlib
+
+class StaticFile:
+    """ class holding a static file together with everything needed
+        to answer requests for it
+    """
+    def __init__(self, path, ctype, max_size):
+        """ constructor method to read the file
+
+            Parameters:
+                path     -- path of the file
+                ctype    -- content type of the file
+                max_size -- files up to this size are kept in memory
+        """
+        stat = os.stat(path)
+        self.path = path
+        self.ctype = ctype
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.body = None
+        if (self.size <= max_size):
+            f = open(path, 'rb')
+            try:
+                self.body = f.read()
+            finally:
+                f.close()
+            self.size = len(self.body)
+            self.etag = '"%s"' % hashlib.md5(self.body).hexdigest()
+        else:
+            # big files are not read just to hash them
+            self.etag = '"%x-%x"' % (self.size, int(self.mtime * 1000))
+        self.headers = "ETag: %s\nCache-Control: no-cache\n" % (self.etag)
+
+    def is_current(self, stat):
+        """ method to check if the file on disk is still the same
+
+            Parameters:
+                stat -- result of os.stat for the file
+        """
+        return stat.st_mtime == self.mtime and stat.st_size == self.size
+
+class FileResponse:
+    """ class for a response whose body is sent straight from a file
+        instead of being built as a string
+    """
+    def __init__(self, header, path, size):
+        """ constructor method
+
+            Parameters:
+                header -- the HTTP header of the response
+                path   -- the file to send as body
+                size   -- number of bytes to send
+        """
+        self.header = header
+        self.path = path
+        self.size = size
+
+    def send(self, connection):
+        """ method to send the response, without copying the file
+            through python if the platform supports sendfile
+
+            Parameters:
+                connection -- the socket of the client
+        """
+        connection.sendall(self.header)
+        f = open(self.path, 'rb')
+        try:
+            if hasattr(connection, "sendfile"):
+                connection.sendfile(f, 0, self.size)
+            elif hasattr(os, "sendfile"):
+                offset = 0
+                while (offset < self.size):
+                    sent = os.sendfile(connection.fileno(), f.fileno(),
+                                       offset, self.size - offset)
+                    if (sent == 0): break
+                    offset += sent
+            else:
+                remaining = self.size
+                while (remaining > 0):
+                    chunk = f.read(min(65536, remaining))
+                    if not chunk: break
+                    connection.sendall(chunk)
+                    remaining -= len(chunk)
+        finally:
+            f.close()
+
+class StaticFiles:
+    """ class caching the files of the docroot. small files are kept
+        in memory, every file is checked for changes on disk when it
+        is requested
+    """
+    def __init__(self, docroot, names, max_size=256*1024):
+        """ constructor method to preload the files
+
+            Parameters:
+                docroot  -- folder the files reside in, with trailing slash
+                names    -- names of the files to preload
+                max_size -- files up to this size are kept in memory
+        """
+        self.docroot = docroot
+        self.max_size = max_size
+        self.files = {}
+        for name in names:
+            self.get(name)
+
+    def get_content_type(self, name):
+        """ method to get the content type from the file extension """
+        ctypes = name.split(".")
+        if len(ctypes) > 1:
+            return ctypes[len(ctypes)-1]
+        return "html"
+
+    def get(self, name):
+        """ method to get a file, it is reloaded if it changed on disk
+
+            Parameters:
+                name -- the name of the file in the docroot
+
+            Returns:
+                StaticFile object or None if there is no such file
+        """
+        if (not name or "/" in name or name.startswith(".")): return None
+        path = self.docroot + name
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.files.pop(name, None)
+            return None
+        static = self.files.get(name)
+        if (static is None or not static.is_current(stat)):
+            if not os.path.isfile(path): return None
+            try:
+                static = StaticFile(path, self.get_content_type(name), self.max_size)
+            except (IOError, OSError):
+                return None
+            self.files[name] = static
+        return static
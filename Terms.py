@@ -0,0 +1,93 @@
+"""
+@file Terms.py
+@brief dictionary of the terms of an index with dense term ids
+@version 0.1
+"""
+
+import sys
+from array import array
+
+def build_dictionary(terms):
+    """ function to build a term dictionary from a sorted list
+
+        Parameters:
+            terms -- sorted list of distinct terms
+
+        Returns:
+            TermDictionary of the terms
+    """
+    offsets = array('I', [0])
+    for t in terms:
+        offsets.append(offsets[-1] + len(t))
+    return TermDictionary("".join(terms), offsets)
+
+class TermDictionary(object):
+    """ Class mapping the terms of an index to dense integer ids
+
+        the terms are sorted and concatenated into a single buffer,
+        the id of a term is its position in the sorted order. the
+        terms are found with bisection over the buffer, so no
+        string object or hash entry is kept per term
+
+        blob    = "term..."
+        offsets = array('I', [ offset, ... ])
+    """
+    def __init__(self, blob, offsets, base=0):
+        """ Constructor
+
+            Parameters:
+                blob    -- buffer holding the concatenated terms,
+                           a string or a mapped file
+                offsets -- array of the term count+1 offsets of the
+                           terms relative to base
+                base    -- position of the first term in the blob
+        """
+        self.blob = blob
+        self.offsets = offsets
+        self.base = base
+        self.count = len(offsets) - 1
+
+    def find(self, term):
+        """ method to get the id of a term
+
+            Parameters:
+                term -- the term to look for
+
+            Returns:
+                the id of the term or -1 if it is not contained
+        """
+        # bisection over the buffer, without a method call per step
+        blob, offsets, base = self.blob, self.offsets, self.base
+        lo, hi = 0, self.count
+        while (lo < hi):
+            mid = (lo + hi) // 2
+            if (blob[base+offsets[mid]:base+offsets[mid+1]] < term): lo = mid + 1
+            else: hi = mid
+        if (lo < self.count and blob[base+offsets[lo]:base+offsets[lo+1]] == term):
+            return lo
+        return -1
+
+    def get_memory_usage(self):
+        """ method to get the memory used by the dictionary
+
+            Returns:
+                size in bytes
+        """
+        size = sys.getsizeof(self) + sys.getsizeof(self.offsets)
+        if isinstance(self.blob, str): size += sys.getsizeof(self.blob)
+        return size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if (i < 0): i += self.count
+        if (i < 0 or i >= self.count): raise IndexError(i)
+        return self.blob[self.base+self.offsets[i]:self.base+self.offsets[i+1]]
+
+    def __iter__(self):
+        for i in xrange(self.count):
+            yield self[i]
+
+    def __contains__(self, term):
+        return self.find(term) != -1
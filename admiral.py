@@ -6,9 +6,32 @@ Description: usage script to invoke webserver with indexed documents
 """
 import sys
 import Server
+from operator import itemgetter
 
 from optparse import OptionParser
 
+def index_created(server, size, output=None, budget=None):
+    """ function to report the built index and to write it to a
+        segment file if one was given
+
+        Parameters:
+            server -- the web server serving the index
+            size   -- number of words in the index
+            output -- the segment file to write the index to
+            budget -- memory budget of the build, the index was merged
+                      into the segment file already if it is given
+    """
+    print "Index created with %s words." % (size)
+    if budget:
+        # the postings stay in the mapped segment
+        if output: print "Index written to %s." % (output)
+        return
+    print "Postings use %s bytes in total, %.1f bytes per posting." % (
+          itemgetter(0,2)(server.index_manager.get_memory_usage()))
+    if output:
+        server.index_manager.write_segment(output)
+        print "Index written to %s." % (output)
+
 def main():
     """ main function to initialize the whole web server
     """
@@ -21,17 +44,81 @@ def main():
                       help="port on which the server should listen")
     parser.add_option("-d", "--docroot", action="store", dest="docroot", metavar="DOCROOT", default=".",
                       help="docroot for pages to be served from the webserver")
+    parser.add_option("-w", "--workers", action="store", type="int", dest="workers", metavar="NUM", default="1",
+                      help="number of processes used to build the index")
+    parser.add_option("-b", "--backlog", action="store", type="int", dest="backlog", metavar="NUM", default="128",
+                      help="number of connections waiting to be accepted")
+    parser.add_option("-t", "--threads", action="store", type="int", dest="threads", metavar="NUM", default="8",
+                      help="number of threads handling connections")
+    parser.add_option("-c", "--cache-size", action="store", type="int", dest="cache_size", metavar="MB", default="16",
+                      help="memory for cached query results in megabytes, 0 disables the cache")
+    parser.add_option("-s", "--shards", action="store", type="int", dest="shards", metavar="NUM", default="1",
+                      help="number of processes the index is spread over to answer queries")
+    parser.add_option("-z", "--compress", action="store_true", dest="compress", default=False,
+                      help="keep the posting lists compressed to save memory")
+    parser.add_option("-r", "--impacts", action="store_true", dest="impacts", default=False,
+                      help="keep the postings ordered by score to stop ranked searches early")
+    parser.add_option("-m", "--memory", action="store", type="int", dest="memory", metavar="MB",
+                      help="build the index within MB megabytes, spilling sorted runs to disk")
+    parser.add_option("-n", "--no-wait", action="store_true", dest="background", default=False,
+                      help="bind to the port at once and build the index in the background")
+    parser.add_option("-u", "--reindex", action="store_true", dest="reindex", default=False,
+                      help="update the index in the background on POST requests to /reindex")
+    parser.add_option("-i", "--index", action="store", dest="index", metavar="FILE",
+                      help="serve a prebuilt index segment instead of indexing the folder")
+    parser.add_option("-o", "--output", action="store", dest="output", metavar="FILE",
+                      help="write the built index to a segment file")
 
     (options, args) = parser.parse_args()
 
-    if not options.folder:
+    if not options.folder and not options.index:
         parser.error("No folder to parse provided.")
+    elif (options.reindex and options.index and not options.folder):
+        # the segment doesn't know the folder it was built from, the
+        # update would scan the working directory instead
+        parser.error("Updating a loaded index needs the folder it was built from, use -u with -f.")
+    elif (options.shards > 1 and (options.index or options.output)):
+        parser.error("Sharded indexes can not be read from or written to segments.")
+    elif (options.shards > 1 and options.workers > 1):
+        # the shards are daemonic processes which can't start workers,
+        # they build their parts at the same time instead
+        parser.error("Sharded indexes are built by the shards, use -s without -w.")
+    elif (options.memory and (options.shards > 1 or options.workers > 1)):
+        parser.error("Builds within a memory budget use a single process.")
+    elif (options.memory and options.compress):
+        # the postings of a budgeted build are served from the segment
+        parser.error("Builds within a memory budget are served from a segment, use -m without -z.")
+    elif (options.impacts and (options.compress or options.memory)):
+        # the documents read from the impact ordered lists are looked
+        # up in the other lists, which needs random access to them
+        parser.error("Impact ordered lists need uncompressed posting lists held in memory.")
     else:
+        budget = None
+        if options.memory: budget = options.memory*1024*1024
         print "Creating server object."
-        server = Server.Webserver(port=options.port, docroot=options.docroot)
-        print "Indexing Files..."
-        size = server.build_index(options.folder)
-        print "Index created with %s words." % (size)
+        server = Server.Webserver(port=options.port, docroot=options.docroot,
+                                  backlog=options.backlog, threads=options.threads,
+                                  cache_bytes=options.cache_size*1024*1024,
+                                  reindex=options.reindex)
+        if options.index:
+            print "Loading index..."
+            size = server.load_index(options.index, options.folder or ".",
+                                     options.impacts)
+            print "Index loaded with %s words." % (size)
+        elif options.background:
+            print "Indexing Files in the background..."
+            server.build_index_background(options.folder, options.workers,
+                                          options.compress, options.shards,
+                                          budget, options.output,
+                                          lambda size: index_created(server, size,
+                                                                     options.output, budget),
+                                          options.impacts)
+        else:
+            print "Indexing Files..."
+            size = server.build_index(options.folder, options.workers,
+                                      options.compress, options.shards,
+                                      budget, options.output, options.impacts)
+            index_created(server, size, options.output, budget)
         print "Binding server to port ... done."
         server.bind_to_port()
 
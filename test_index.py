@@ -0,0 +1,258 @@
+"""
+@file test_index.py
+@brief tests building and searching the inverted index in its
+       different forms against a plain index of the same documents
+@version 0.1
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+import Benchmark
+import InvertedIndex
+import Shards
+
+def make_corpus(folder, documents=60, seed=7):
+    """ function to write a small corpus of zipf distributed words
+
+        Parameters:
+            folder    -- folder to write the files to
+            documents -- number of files
+            seed      -- seed of the random generator
+    """
+    Benchmark.generate_corpus(folder, documents, 300, 80, 1.0, seed)
+
+def quiet(method, *args):
+    """ function to call a method without its progress output
+
+        Parameters:
+            method -- the method to call
+            args   -- arguments of the method
+
+        Returns:
+            the result of the method
+    """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return method(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def build(folder, workers=1, **options):
+    """ function to build an index of a folder
+
+        Parameters:
+            folder  -- the folder with the documents
+            workers -- number of processes to build the index with
+            options -- further arguments of the IndexManager
+
+        Returns:
+            the built IndexManager
+    """
+    manager = InvertedIndex.IndexManager(folder, **options)
+    quiet(manager.build_index, workers)
+    return manager
+
+# queries of frequent, medium and rare words and of words not in the index
+QUERIES = ([[Benchmark.make_word(r)] for r in (0, 5, 40, 200)] +
+           [[Benchmark.make_word(a), Benchmark.make_word(b)]
+            for a,b in ((0, 1), (2, 30), (10, 150), (0, 299))] +
+           [[Benchmark.make_word(0), Benchmark.make_word(3), Benchmark.make_word(60)],
+            ["notaword"], [Benchmark.make_word(0), "notaword"]])
+
+class IndexTestCase(unittest.TestCase):
+    """ base class of the tests, writing a corpus to a temporary
+        folder and building the plain index of it
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="admiral-test-")
+        make_corpus(self.folder)
+        self.index = build(self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def assertSameResults(self, first, second):
+        """ method to compare the results of two searches, documents
+            with the same score may be ranked in any order
+        """
+        if (first == -1 or second == -1):
+            self.assertEqual(first, second)
+            return
+        self.assertEqual([round(s, 9) for f,s in first],
+                         [round(s, 9) for f,s in second])
+        self.assertEqual(sorted([(round(s, 9), f) for f,s in first]),
+                         sorted([(round(s, 9), f) for f,s in second]))
+
+    def assertSameIndex(self, index, limit=None):
+        """ method to compare the searches of an index with the ones
+            of the plain index
+        """
+        for keywords in QUERIES:
+            self.assertSameResults(self.index.get_andish_retrieval(keywords, limit),
+                                   index.get_andish_retrieval(keywords, limit))
+
+    def get_phrase(self):
+        """ method to get three neighbouring words of a document """
+        name = sorted(self.index.manifest)[0]
+        words = open(os.path.join(self.folder, name)).read().split()
+        return name, words[3:6]
+
+class BuildTest(IndexTestCase):
+
+    def test_parallel_build(self):
+        index = build(self.folder, 3)
+        self.assertEqual(index.doc_count, self.index.doc_count)
+        self.assertEqual(sorted(index.get_word_frequencies()),
+                         sorted(self.index.get_word_frequencies()))
+        for keywords in QUERIES:
+            self.assertEqual(index.get_andish_retrieval(keywords),
+                             self.index.get_andish_retrieval(keywords))
+
+    def test_segment_round_trip(self):
+        path = os.path.join(self.folder, "index.segment")
+        self.index.write_segment(path)
+        index = InvertedIndex.IndexManager(self.folder, walk=False)
+        index.load_segment(path)
+        self.assertEqual(index.doc_count, self.index.doc_count)
+        self.assertEqual(index.manifest, self.index.manifest)
+        self.assertEqual(sorted(index.get_word_frequencies()),
+                         sorted(self.index.get_word_frequencies()))
+        self.assertSameIndex(index)
+        name,phrase = self.get_phrase()
+        self.assertEqual(index.get_phrase_retrieval(phrase),
+                         self.index.get_phrase_retrieval(phrase))
+
+    def test_incremental_update(self):
+        names = sorted(self.index.manifest)
+        # one file is changed, one removed and one added
+        f = open(os.path.join(self.folder, names[0]), 'a')
+        f.write("appended words\n")
+        f.close()
+        os.remove(os.path.join(self.folder, names[1]))
+        shutil.copy(os.path.join(self.folder, names[2]),
+                    os.path.join(self.folder, "added.txt"))
+        self.assertEqual(quiet(self.index.update_index), (1, 1, 1))
+        self.assertEqual(quiet(self.index.update_index), (0, 0, 0))
+        fresh = build(self.folder)
+        self.assertEqual(self.index.doc_count, fresh.doc_count)
+        self.assertEqual(self.index.get_andish_retrieval(["appended"]),
+                         fresh.get_andish_retrieval(["appended"]))
+        for keywords in QUERIES:
+            self.assertSameResults(self.index.get_andish_retrieval(keywords),
+                                   fresh.get_andish_retrieval(keywords))
+
+    def test_external_build(self):
+        # a small fan-in makes the runs merge in several passes
+        fanin = InvertedIndex.MERGE_FANIN
+        InvertedIndex.MERGE_FANIN = 2
+        try:
+            index = InvertedIndex.IndexManager(self.folder)
+            runs = []
+            write_run = index.write_run
+            def count_runs(folder, number):
+                runs.append(number)
+                return write_run(folder, number)
+            index.write_run = count_runs
+            quiet(index.build_index_external, InvertedIndex.get_peak_memory() + 300000)
+        finally:
+            InvertedIndex.MERGE_FANIN = fanin
+        self.assertTrue(len(runs) > 2)
+        self.assertEqual(index.doc_count, self.index.doc_count)
+        self.assertSameIndex(index)
+
+    def test_budget_too_small(self):
+        index = InvertedIndex.IndexManager(self.folder)
+        self.assertRaises(ValueError, quiet, index.build_index_external,
+                          InvertedIndex.get_peak_memory() + 1000)
+
+class SearchTest(IndexTestCase):
+
+    def test_phrase_search(self):
+        name,phrase = self.get_phrase()
+        results = [f for f,s in self.index.get_phrase_retrieval(phrase)]
+        self.assertTrue(name in results)
+        # every document holding the words next to each other is found
+        expected = []
+        for other in self.index.manifest:
+            words = open(os.path.join(self.folder, other)).read().split()
+            if any([words[i:i+3] == phrase for i in range(len(words))]):
+                expected.append(other)
+        self.assertEqual(sorted(results), sorted(expected))
+        self.assertEqual(self.index.get_phrase_retrieval(phrase[:1] + ["notaword"]), [])
+
+    def test_completions(self):
+        # the trie is built with the index, not by the first search
+        self.assertTrue(self.index.completions is not None)
+        frequencies = self.index.get_word_frequencies()
+        for prefix in ("", "e", "ta"):
+            expected = sorted([(-df, w) for w,df in frequencies if w.startswith(prefix)])
+            for limit in (1, 10, 11, 1000):
+                self.assertEqual(self.index.get_completions(prefix, limit),
+                                 [(w, -df) for df,w in
+                                  expected[:min(limit, InvertedIndex.MAX_COMPLETIONS)]])
+
+    def test_batch_retrieval(self):
+        # the scores are added in the same order, so they agree exactly
+        words = [w for w,df in self.index.get_word_frequencies()]
+        rand = random.Random(3)
+        queries = QUERIES + [[rand.choice(words) for i in range(rand.randint(3, 5))]
+                             for q in range(200)]
+        for limit in (10, None):
+            results = self.index.get_batch_retrieval(queries, limit)
+            for keywords,result in zip(queries, results):
+                self.assertEqual(result, self.index.get_andish_retrieval(keywords, limit))
+
+    def test_compressed_postings(self):
+        index = build(self.folder, compress=True)
+        self.assertSameIndex(index)
+        self.assertSameIndex(index, 5)
+        name,phrase = self.get_phrase()
+        self.assertEqual(index.get_phrase_retrieval(phrase),
+                         self.index.get_phrase_retrieval(phrase))
+
+    def test_impact_ordered_postings(self):
+        index = build(self.folder, impacts=True)
+        for limit in (1, 3, 10, None):
+            self.assertSameIndex(index, limit)
+
+    @unittest.skipUnless(InvertedIndex.numpy, "numpy is not installed")
+    def test_vectorized_scores(self):
+        self.index.vectorize = False
+        expected = [self.index.get_andish_retrieval(k, 10) for k in QUERIES]
+        batch = self.index.get_batch_retrieval(QUERIES, 10)
+        self.index.vectorize = True
+        # the queries over the small corpus are scored with numpy as well
+        minimum = InvertedIndex.VECTOR_MIN
+        InvertedIndex.VECTOR_MIN = 0
+        try:
+            for keywords,result in zip(QUERIES, expected):
+                self.assertSameResults(self.index.get_andish_retrieval(keywords, 10), result)
+            for first,second in zip(self.index.get_batch_retrieval(QUERIES, 10), batch):
+                self.assertSameResults(first, second)
+        finally:
+            InvertedIndex.VECTOR_MIN = minimum
+
+class ShardTest(IndexTestCase):
+
+    def test_sharded_search(self):
+        index = Shards.ShardedIndex(self.folder, 3)
+        try:
+            quiet(index.build_index)
+            self.assertEqual(index.get_document_count(), self.index.doc_count)
+            self.assertSameIndex(index)
+            for first,second in zip(index.get_batch_retrieval(QUERIES),
+                                    self.index.get_batch_retrieval(QUERIES)):
+                self.assertSameResults(first, second)
+            self.assertEqual(index.get_completions(Benchmark.make_word(0), 5),
+                             self.index.get_completions(Benchmark.make_word(0), 5))
+        finally:
+            index.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+"""
+@file test_server.py
+@brief tests the HTTP behaviour of the webserver on a connection
+       to a client
+@version 0.1
+"""
+
+import os
+import re
+import sys
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import Benchmark
+import Server
+import test_index
+
+class ServerTest(unittest.TestCase):
+    """ tests sending raw requests to a webserver serving the index
+        of a small corpus, the connections are handled by the
+        server as if they were accepted
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="admiral-test-")
+        test_index.make_corpus(os.path.join(self.folder, "docs"))
+        docroot = os.path.join(self.folder, "docroot")
+        os.mkdir(docroot)
+        f = open(os.path.join(docroot, "page.html"), 'w')
+        f.write("<html><body>static page</body></html>")
+        f.close()
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        self.server = Server.Webserver(docroot=docroot, reindex=True)
+        self.server.build_index(os.path.join(self.folder, "docs"))
+
+    def tearDown(self):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def request(self, data):
+        """ method to send requests on one connection and to read
+            the answers until the server closes it
+
+            Parameters:
+                data -- the raw requests
+
+            Returns:
+                everything the server sent
+        """
+        client,connection = socket.socketpair()
+        handler = threading.Thread(target=self.server.handle_connection,
+                                   args=(connection, ("test", 0)))
+        handler.start()
+        try:
+            client.sendall(data)
+            answer = []
+            while True:
+                part = client.recv(65536)
+                if not part: break
+                answer.append(part)
+        finally:
+            client.close()
+            handler.join()
+        return "".join(answer)
+
+    def get(self, path, version="1.1", headers=""):
+        """ method to send a single GET request
+
+            Parameters:
+                path    -- the requested path
+                version -- the HTTP version of the request
+                headers -- further header lines
+
+            Returns:
+                tuple of the header and the body of the answer
+        """
+        answer = self.request("GET %s HTTP/%s\r\nHost: test\r\n%sConnection: close\r\n\r\n"
+                              % (path, version, headers))
+        return tuple(answer.split("\n\n", 1))
+
+    def decode_chunks(self, body):
+        """ method to join the chunks of a chunked body """
+        data = []
+        while True:
+            size,body = body.split("\r\n", 1)
+            size = int(size, 16)
+            if (size == 0): break
+            data.append(body[:size])
+            body = body[size+2:]
+        return "".join(data)
+
+    def test_keep_alive(self):
+        word = Benchmark.make_word(0)
+        request = "GET /search?keywords=%s HTTP/1.1\r\nHost: test\r\n\r\n" % word
+        last = "GET /page.html HTTP/1.1\r\nHost: test\r\nConnection: close\r\n\r\n"
+        answer = self.request(request + request + last)
+        self.assertEqual(len(re.findall("HTTP/1.1 200 OK", answer)), 3)
+        self.assertTrue(answer.endswith("static page</body></html>"))
+
+    def test_idle_connections(self):
+        # more idle keep-alive connections than threads answering requests
+        self.server.port = 0
+        self.server.threads = 2
+        self.server.timeout = 2
+        self.server.listen()
+        address = ("127.0.0.1", self.server.socket.getsockname()[1])
+        loop = threading.Thread(target=self.server.serve_connections)
+        loop.start()
+        request = "GET /page.html HTTP/1.1\r\nHost: test\r\n\r\n"
+        clients = [socket.create_connection(address) for i in range(6)]
+        try:
+            for client in clients[:3]:
+                client.sendall(request)
+                self.assertTrue(client.recv(65536).startswith("HTTP/1.1 200"))
+            start = time.time()
+            client = socket.create_connection(address)
+            clients.append(client)
+            client.sendall(request)
+            self.assertTrue(client.recv(65536).startswith("HTTP/1.1 200"))
+            self.assertTrue(time.time() - start < 1)
+            # the idle connections are closed after the timeout
+            clients[0].settimeout(5)
+            self.assertEqual(clients[0].recv(65536), "")
+        finally:
+            for client in clients:
+                client.close()
+            self.server.stop()
+            loop.join()
+
+    def test_request_too_large(self):
+        # the body is not read, the connection is closed after the answer
+        answer = self.request("POST /batch HTTP/1.1\r\nHost: test\r\n"
+                              "Content-Length: %s\r\n\r\n" % (self.server.max_body + 1))
+        self.assertTrue(answer.startswith("HTTP/1.1 413"))
+        self.assertTrue("Connection: close" in answer)
+
+    def test_not_modified(self):
+        header,body = self.get("/page.html")
+        self.assertTrue(header.startswith("HTTP/1.1 200"))
+        etag = re.findall("(?im)^etag:\s*(.*?)\s*$", header)[0]
+        header,body = self.get("/page.html", headers="If-None-Match: %s\r\n" % etag)
+        self.assertTrue(header.startswith("HTTP/1.1 304"))
+        self.assertEqual(body, "")
+        header,body = self.get("/page.html", headers="If-None-Match: \"other\"\r\n")
+        self.assertTrue(header.startswith("HTTP/1.1 200"))
+
+    def test_limits(self):
+        word = Benchmark.make_word(0)
+        header,body = self.get("/search?keywords=%s&limit=0" % word, version="1.0")
+        self.assertEqual(len(re.findall("Score:", body)), 1)
+        header,body = self.get("/search?keywords=%s&limit=100000" % word, version="1.0")
+        self.assertEqual(len(re.findall("Score:", body)),
+                         min(self.server.max_results_per_page,
+                             len(self.server.index_manager.get_andish_retrieval([word]))))
+
+    def test_reindex(self):
+        header,body = self.get("/reindex")
+        self.assertTrue(header.startswith("HTTP/1.1 405"))
+        f = open(os.path.join(self.folder, "docs", "added.txt"), 'w')
+        f.write("reindexed words\n")
+        f.close()
+        answer = self.request("POST /reindex HTTP/1.1\r\nHost: test\r\n"
+                              "Content-Length: 0\r\nConnection: close\r\n\r\n")
+        self.assertTrue(answer.startswith("HTTP/1.1 202"))
+        self.server.reindexing.join()
+        results = self.server.index_manager.get_andish_retrieval(["reindexed"])
+        self.assertEqual([f for f,s in results], ["added.txt"])
+
+    def test_cached_search(self):
+        word = Benchmark.make_word(0)
+        path = "/search?keywords=%s&limit=1000" % word
+        cache = self.server.cache
+        header,page = self.get(path)
+        stats = cache.get_stats()
+        header,cached = self.get(path)
+        self.assertEqual(cache.get_stats()["hits"], stats["hits"] + 1)
+        self.assertEqual(self.decode_chunks(page), cached)
+        # an update of the index drops the cached pages
+        f = open(os.path.join(self.folder, "docs", "added.txt"), 'w')
+        f.write("%s reindexed\n" % word)
+        f.close()
+        answer = self.request("POST /reindex HTTP/1.1\r\nHost: test\r\n"
+                              "Content-Length: 0\r\nConnection: close\r\n\r\n")
+        self.assertTrue(answer.startswith("HTTP/1.1 202"))
+        self.server.reindexing.join()
+        stats = cache.get_stats()
+        header,page = self.get(path)
+        self.assertEqual(cache.get_stats()["misses"], stats["misses"] + 1)
+        self.assertEqual(cache.get_stats()["hits"], stats["hits"])
+        page = self.decode_chunks(page)
+        self.assertTrue("added.txt" in page)
+        self.assertEqual(len(re.findall("Score:", page)),
+                         len(re.findall("Score:", cached)) + 1)
+
+    def test_batch(self):
+        queries = [[Benchmark.make_word(0)], [Benchmark.make_word(1), Benchmark.make_word(7)],
+                   ["notaword"]]
+        body = "".join(["%s\n" % "+".join(q) for q in queries])
+        answer = self.request("POST /batch?limit=5 HTTP/1.1\r\nHost: test\r\n"
+                              "Content-Length: %s\r\nConnection: close\r\n\r\n%s"
+                              % (len(body), body))
+        header,text = answer.split("\n\n", 1)
+        self.assertTrue(header.startswith("HTTP/1.1 200"))
+        lines = text.split("\n")[:-1]
+        self.assertEqual(len(lines), len(queries))
+        for line,keywords in zip(lines, queries):
+            names = line.split("\t")[::2]
+            expected = self.server.index_manager.get_andish_retrieval(keywords, 5)
+            self.assertEqual(names, [f for f,s in expected] or [""])
+        body = "w\n" * (self.server.max_batch_queries + 1)
+        answer = self.request("POST /batch HTTP/1.1\r\nHost: test\r\n"
+                              "Content-Length: %s\r\nConnection: close\r\n\r\n%s"
+                              % (len(body), body))
+        self.assertTrue(answer.startswith("HTTP/1.1 413"))
+
+    def test_chunked_search(self):
+        word = Benchmark.make_word(0)
+        path = "/search?keywords=%s&limit=50" % word
+        header,body = self.get(path)
+        self.assertTrue("Transfer-Encoding: chunked" in header)
+        page = self.decode_chunks(body)
+        results = self.server.index_manager.get_andish_retrieval([word], 50)
+        self.assertEqual(len(re.findall("Score:", page)), len(results))
+        self.assertTrue(page.endswith("</body></html>"))
+        # clients of HTTP/1.0 get the page without chunks, the other
+        # offset keeps the page from being answered from the cache
+        header,plain = self.get(path + "&offset=0", version="1.0")
+        self.assertFalse("Transfer-Encoding" in header)
+        self.assertEqual(plain, page)
+
+if __name__ == '__main__':
+    unittest.main()